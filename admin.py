@@ -1,18 +1,47 @@
-import sqlite3
-import requests
-from payment_method import HEADERS, CRYPTO_PAY_API_BASE
+import asyncio
+import logging
+import os
+from datetime import date
+from payment_method import crypto_pay
+from crypto_pay import CryptoPayError
+from database import fetchone, fetchall, execute
+from referrals import backfill_referral_counts
+from rendering import edit_message
+from withdrawals import get_pending_withdrawals, count_pending_withdrawals, approve_withdrawals, reject_withdrawals
+from callbacks import Action, callback_data, router
+from fanout import notifier, BroadcastProgress
+from payouts import schedule_payouts, settle_failed_payouts
+from export import EXPORTS, EXPORT_FORMATS, export_table
+from stats import STATS_DAYS, get_stats, rebuild_stats
+from users import retier_users
+from config import ADMIN_IDS
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from telegram.ext import ContextTypes, CommandHandler
 
-ADMIN_IDS = [1075995888]  # <--- Replace with your Telegram ID
+logger = logging.getLogger(__name__)
+
+# "Approve all up to $X" buttons on the withdrawal queue
+BULK_APPROVE_THRESHOLDS = (10, 50, 100)
 
 def add_admin_handlers(application):
     application.add_handler(CommandHandler("admin", admin_panel))
-    application.add_handler(CallbackQueryHandler(show_pending_withdrawals, pattern="^admin_withdrawals$"))
-    application.add_handler(CallbackQueryHandler(show_pending_invoices, pattern="^admin_invoices$"))
-    application.add_handler(CallbackQueryHandler(handle_approve_withdrawal, pattern="^approve_"))
-    application.add_handler(CallbackQueryHandler(handle_reject_withdrawal, pattern="^reject_"))
-    application.add_handler(CallbackQueryHandler(handle_delete_invoice, pattern="^delete_invoice_"))
+    application.add_handler(CommandHandler("recount_referrals", recount_referrals))
+    application.add_handler(CommandHandler("routes", route_stats))
+    application.add_handler(CommandHandler("broadcast", broadcast))
+    application.add_handler(CommandHandler("export", export))
+    application.add_handler(CommandHandler("stats", show_stats))
+    application.add_handler(CommandHandler("rebuild_stats", rebuild_stats_command))
+    application.add_handler(CommandHandler("retier", retier))
+    router.add(Action.ADMIN_WITHDRAWALS, show_pending_withdrawals)
+    router.add(Action.ADMIN_INVOICES, show_pending_invoices)
+    router.add(Action.APPROVE_WITHDRAWAL, handle_approve_withdrawal)
+    router.add(Action.REJECT_WITHDRAWAL, handle_reject_withdrawal)
+    router.add(Action.DELETE_INVOICE, handle_delete_invoice)
+    router.add(Action.TOGGLE_WITHDRAWAL, toggle_withdrawal)
+    router.add(Action.CLEAR_SELECTION, clear_withdrawal_selection)
+    router.add(Action.APPROVE_SELECTED, approve_selected_withdrawals)
+    router.add(Action.REJECT_SELECTED, reject_selected_withdrawals)
+    router.add(Action.APPROVE_UNDER, approve_withdrawals_under)
 
 
 # Admin Panel Entry
@@ -23,59 +52,408 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     keyboard = [
-        [InlineKeyboardButton("📄 Pending Withdrawals", callback_data="admin_withdrawals")],
-        [InlineKeyboardButton("💰 Unpaid Invoices", callback_data="admin_invoices")]
+        [InlineKeyboardButton("📄 Pending Withdrawals", callback_data=callback_data(Action.ADMIN_WITHDRAWALS))],
+        [InlineKeyboardButton("💰 Unpaid Invoices", callback_data=callback_data(Action.ADMIN_INVOICES))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("🔐 *Admin Panel*", parse_mode="Markdown", reply_markup=reply_markup)
 
-# Show Pending Withdrawals
+# Rebuild materialized referral counters
+async def recount_referrals(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    # One UPDATE over every user: keep it off the event loop
+    updated = await asyncio.to_thread(backfill_referral_counts)
+    await update.message.reply_text(f"✅ Referral counters recomputed for {updated} users.")
+
+# Per-button call counts and handler latencies
+async def route_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    report = f"📈 Callback routes\n\n{router.report() or 'No routes registered.'}"
+    processor = context.application.update_processor
+    if hasattr(processor, "report"):
+        report += f"\n\n⚙️ Update scheduler\n\n{processor.report()}"
+    await update.message.reply_text(report)
+
+# Re-apply the TIERS thresholds to every user, e.g. after changing them
+async def retier(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    # Set-based, but still seconds on a large table: keep it off the event loop
+    moved = await asyncio.to_thread(retier_users)
+    if not moved:
+        await update.message.reply_text("✅ Every user is already in the right tier.")
+        return
+    lines = [f"{old} → {new}: {count}" for (old, new), count in sorted(moved.items(), key=lambda item: -item[1])]
+    await update.message.reply_text(f"✅ Re-tiered {sum(moved.values())} users\n\n" + "\n".join(lines))
+
+def iter_user_ids(batch_size=1000):
+    """Every registered user_id, read in keyset-paginated batches."""
+    last_id = 0
+    while True:
+        rows = fetchall("SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (last_id, batch_size))
+        if not rows:
+            return
+        for (user_id,) in rows:
+            yield user_id
+        last_id = rows[-1][0]
+
+# Message every user: /broadcast <text>
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    running = context.bot_data.get("broadcast")
+    if running is not None and not running.done:
+        await update.message.reply_text(f"📣 A broadcast is already running.\n\n{running.summary()}")
+        return
+
+    text = update.message.text.partition(" ")[2].strip()
+    if not text:
+        await update.message.reply_text("Usage: /broadcast <message>")
+        return
+
+    progress = BroadcastProgress(total=fetchone("SELECT COUNT(*) FROM users")[0])
+    context.bot_data["broadcast"] = progress
+    status = await update.message.reply_text(f"📣 Broadcasting to {progress.total} users...")
+
+    async def on_progress(progress):
+        title = "✅ Broadcast finished" if progress.done else "📣 Broadcasting..."
+        await status.edit_text(f"{title}\n\n{progress.summary()}")
+
+    # Runs in the background so the admin's chat stays responsive
+    context.application.create_task(
+        notifier.broadcast(context.bot, iter_user_ids(), text, progress=progress, on_progress=on_progress),
+        update=update
+    )
+
+def _sum_metrics(totals, prefix):
+    """(count, usd) summed over metrics starting with ``prefix``, plus per-asset totals."""
+    count = usd = 0
+    by_asset = {}
+    for metric, (metric_count, metric_usd) in totals.items():
+        if metric.startswith(prefix):
+            count += metric_count
+            usd += metric_usd
+            by_asset[metric[len(prefix):]] = (metric_count, metric_usd)
+    return count, usd, by_asset
+
+def format_stats(stats):
+    today, period = stats["today"], stats["period"]
+    lines = ["📊 *Bot Statistics*\n"]
+
+    signups = lambda totals: totals.get("signup", (0, 0))[0]
+    referred = lambda totals: totals.get("referred_signup", (0, 0))[0]
+    lines.append(f"*Users:* {sum(stats['tiers'].values())} total")
+    lines.append(f"New today: {signups(today)} ({referred(today)} referred)")
+    lines.append(f"New {STATS_DAYS}d: {signups(period)} ({referred(period)} referred)\n")
+
+    lines.append("*Tiers:* " + " · ".join(f"{tier} {users}" for tier, users in sorted(stats["tiers"].items()) if users))
+
+    count, usd, by_asset = _sum_metrics(period, "deposit_")
+    lines.append(f"\n*Deposits {STATS_DAYS}d:* {count} · ${usd:.2f} (today ${_sum_metrics(today, 'deposit_')[1]:.2f})")
+    for asset, (asset_count, asset_usd) in sorted(by_asset.items()):
+        lines.append(f"  {asset}: {asset_count} · ${asset_usd:.2f}")
+
+    lines.append(f"\n*Bonuses {STATS_DAYS}d:*")
+    for metric, label in (("daily_bonus", "Daily"), ("referral_bonus", "Referral")):
+        metric_count, metric_usd = period.get(metric, (0, 0))
+        lines.append(f"  {label}: {metric_count} · ${metric_usd:.2f}")
+
+    count, usd, _ = _sum_metrics(period, "withdrawal_request_")
+    lines.append(f"\n*Withdrawals requested {STATS_DAYS}d:* {count} · ${-usd:.2f}")
+    for status in ("pending", "approved", "processing", "failed", "completed", "rejected"):
+        if status in stats["withdrawals"]:
+            status_count, status_usd = stats["withdrawals"][status]
+            lines.append(f"  {status.capitalize()}: {status_count} · ${status_usd:.2f}")
+
+    return "\n".join(lines)
+
+# Operational dashboard, rendered from the rollup tables
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    await update.message.reply_text(format_stats(get_stats()), parse_mode="Markdown")
+
+# Recompute the rollups from the raw tables
+async def rebuild_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    # Rewrites the rollups from full scans of users, transactions and
+    # withdrawal_requests: keep it off the event loop
+    await asyncio.to_thread(rebuild_stats)
+    await update.message.reply_text("✅ Statistics rebuilt from the raw tables.")
+
+EXPORT_USAGE = (
+    "Usage: /export <transactions|invoices|withdrawals> [csv|jsonl] "
+    "[from=YYYY-MM-DD] [to=YYYY-MM-DD] [type=prefix]\n\n"
+    "type= matches the transaction type (e.g. deposit, daily_bonus) "
+    "or the invoice/withdrawal status."
+)
+
+def parse_export_args(args):
+    """(name, format, since, until, prefix) from /export arguments, or None."""
+    if not args or args[0] not in EXPORTS:
+        return None
+    fmt, options = "csv", {}
+    for arg in args[1:]:
+        if arg in EXPORT_FORMATS:
+            fmt = arg
+            continue
+        key, sep, value = arg.partition("=")
+        if not sep or key not in ("from", "to", "type"):
+            return None
+        options[key] = value
+    try:
+        for key in ("from", "to"):
+            if key in options:
+                date.fromisoformat(options[key])
+    except ValueError:
+        return None
+    return args[0], fmt, options.get("from"), options.get("to"), options.get("type")
+
+# Stream a table to the admin as gzip CSV/JSONL documents
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+
+    parsed = parse_export_args(context.args)
+    if parsed is None:
+        await update.message.reply_text(EXPORT_USAGE)
+        return
+    name, fmt, since, until, prefix = parsed
+    chat_id = update.effective_chat.id
+    await update.message.reply_text(f"📦 Exporting {name}...")
+
+    async def send_part(path, rows):
+        with open(path, "rb") as document:
+            await context.bot.send_document(
+                chat_id,
+                document=document,
+                filename=os.path.basename(path),
+                caption=f"{rows} rows",
+                read_timeout=120,
+                write_timeout=120
+            )
+
+    async def run():
+        try:
+            rows, parts = await export_table(name, fmt, send_part, since=since, until=until, prefix=prefix)
+        except Exception as e:
+            logger.error(f"Export of {name} failed: {e}")
+            await context.bot.send_message(chat_id, f"❌ Export failed: {e}")
+            return
+        await context.bot.send_message(chat_id, f"✅ Exported {rows} {name} rows in {parts} file(s).")
+
+    # Runs in the background so updates keep flowing during long exports
+    context.application.create_task(run(), update=update)
+
+# Withdrawal queue: one paginated message with multi-select and bulk actions
 async def show_pending_withdrawals(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT request_id, user_id, amount, asset, wallet_address FROM withdrawal_requests WHERE status = 'pending'")
-    rows = cursor.fetchall()
-    conn.close()
+    if update.effective_user.id not in ADMIN_IDS:
+        await edit_message(query, "❌ You are not authorized to manage withdrawals.")
+        return
+
+    # Remember the page so toggles and bulk actions can redraw it
+    context.user_data['withdrawal_page'] = list(context.args)
+    await render_withdrawal_queue(query, context)
+
+async def render_withdrawal_queue(query, context, notice=None):
+    page = context.user_data.get('withdrawal_page') or []
+    direction, cursor = page if len(page) == 2 else (None, None)
+    rows, has_prev, has_next = get_pending_withdrawals(
+        after=int(cursor) if direction == "a" else None,
+        before=int(cursor) if direction == "b" else None
+    )
+
+    if not rows and page:
+        # Everything on this page was processed; fall back to the first page
+        context.user_data['withdrawal_page'] = []
+        return await render_withdrawal_queue(query, context, notice)
 
+    header = f"{notice}\n\n" if notice else ""
     if not rows:
-        await query.edit_message_text("✅ No pending withdrawals.")
+        await edit_message(query, header + "✅ No pending withdrawals.")
         return
 
-    messages = []
-    for row in rows:
-        request_id, user_id, amount, asset, wallet = row
-        buttons = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("✅ Approve", callback_data=f"approve_{request_id}"),
-                InlineKeyboardButton("❌ Reject", callback_data=f"reject_{request_id}")
-            ]
+    selected = set(context.user_data.get('withdrawal_selection', []))
+    pending_count, pending_usd = count_pending_withdrawals()
+
+    lines = [f"📄 *Pending Withdrawals:* {pending_count} (${pending_usd:.2f})\n"]
+    keyboard = []
+    for request_id, user_id, amount, asset, wallet, usd_amount in rows:
+        usd = f" (${usd_amount:.2f})" if usd_amount is not None else ""
+        lines.append(f"#{request_id} · {amount} {asset}{usd} · user `{user_id}`\n`{wallet}`")
+        mark = "☑️" if request_id in selected else "⬜"
+        keyboard.append([InlineKeyboardButton(
+            f"{mark} #{request_id} · {amount} {asset}",
+            callback_data=callback_data(Action.TOGGLE_WITHDRAWAL, request_id)
+        )])
+
+    page_nav = []
+    if has_prev:
+        page_nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=callback_data(Action.ADMIN_WITHDRAWALS, "b", rows[0][0])))
+    if has_next:
+        page_nav.append(InlineKeyboardButton("Next ➡️", callback_data=callback_data(Action.ADMIN_WITHDRAWALS, "a", rows[-1][0])))
+    if page_nav:
+        keyboard.append(page_nav)
+
+    if selected:
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Approve selected ({len(selected)})", callback_data=callback_data(Action.APPROVE_SELECTED)),
+            InlineKeyboardButton(f"❌ Reject selected ({len(selected)})", callback_data=callback_data(Action.REJECT_SELECTED))
         ])
-        await query.message.reply_text(
-            f"🆔 Request ID: `{request_id}`\n👤 User: `{user_id}`\n💸 Amount: {amount} {asset}\n🏦 Wallet: `{wallet}`",
-            reply_markup=buttons,
-            parse_mode="Markdown"
+        keyboard.append([InlineKeyboardButton("Clear selection", callback_data=callback_data(Action.CLEAR_SELECTION))])
+
+    keyboard.append([
+        InlineKeyboardButton(f"✅ All ≤ ${threshold}", callback_data=callback_data(Action.APPROVE_UNDER, threshold))
+        for threshold in BULK_APPROVE_THRESHOLDS
+    ])
+
+    await edit_message(
+        query,
+        header + "\n\n".join(lines),
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="Markdown"
+    )
+
+async def toggle_withdrawal(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    request_id = int(context.args[0])
+    selected = set(context.user_data.get('withdrawal_selection', []))
+    selected ^= {request_id}
+    context.user_data['withdrawal_selection'] = sorted(selected)
+    await render_withdrawal_queue(query, context)
+
+async def clear_withdrawal_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    context.user_data.pop('withdrawal_selection', None)
+    await render_withdrawal_queue(query, context)
+
+async def approve_selected_withdrawals(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("❌ Not authorized.")
+        return
+
+    rows = approve_withdrawals(context.user_data.pop('withdrawal_selection', []))
+    withdrawals_processed(context, approved=rows)
+
+    await query.answer(f"Approved {len(rows)} requests.")
+    await render_withdrawal_queue(query, context, notice=f"✅ Approved {len(rows)} withdrawal requests.")
+
+async def reject_selected_withdrawals(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("❌ Not authorized.")
+        return
+
+    selection = context.user_data.pop('withdrawal_selection', [])
+    try:
+        paid = await settle_failed_payouts(context.bot, selection)
+    except CryptoPayError as e:
+        context.user_data['withdrawal_selection'] = selection
+        logger.error(f"Could not check earlier payouts before rejecting: {e}")
+        await query.answer("⚠️ Could not reach Crypto Pay, nothing was rejected.")
+        return
+    rows = reject_withdrawals([request_id for request_id in selection if request_id not in paid])
+    withdrawals_processed(context, rejected=rows)
+
+    await query.answer(f"Rejected {len(rows)} requests.")
+    await render_withdrawal_queue(query, context, notice=f"❌ Rejected {len(rows)} withdrawal requests; funds returned.")
+
+async def approve_withdrawals_under(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Approve every pending request worth at most the threshold, after a confirmation step."""
+    query = update.callback_query
+
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("❌ Not authorized.")
+        return
+
+    max_usd = float(context.args[0])
+    confirmed = len(context.args) > 1 and context.args[1] == "y"
+
+    if not confirmed:
+        await query.answer()
+        count, total_usd = count_pending_withdrawals(max_usd)
+        if not count:
+            await render_withdrawal_queue(query, context, notice=f"No pending requests of ${max_usd:g} or less.")
+            return
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton("✅ Confirm", callback_data=callback_data(Action.APPROVE_UNDER, context.args[0], "y")),
+            InlineKeyboardButton("🔙 Cancel", callback_data=callback_data(Action.ADMIN_WITHDRAWALS, *context.user_data.get('withdrawal_page', [])))
+        ]])
+        await edit_message(
+            query,
+            f"Approve {count} pending withdrawal requests of ${max_usd:g} or less (${total_usd:.2f} in total)?",
+            reply_markup=keyboard
         )
+        return
 
-    await query.edit_message_text("📄 Showing pending withdrawal requests...")
+    rows = approve_withdrawals(max_usd=max_usd)
+    withdrawals_processed(context, approved=rows)
+
+    await query.answer(f"Approved {len(rows)} requests.")
+    await render_withdrawal_queue(query, context, notice=f"✅ Approved {len(rows)} withdrawal requests of ${max_usd:g} or less.")
+
+def withdrawals_processed(context, approved=(), rejected=()):
+    """Start paying approved withdrawals and queue the user notifications."""
+    bot = context.bot
+    if approved:
+        schedule_payouts(context.application)
+    for _, user_id, amount, asset, _, _ in approved:
+        notifier.enqueue(
+            bot,
+            user_id,
+            f"✅ Your withdrawal of {amount} {asset} has been approved and will be sent shortly."
+        )
+    for _, user_id, amount, _, _, usd_amount in rejected:
+        refund = usd_amount if usd_amount is not None else amount
+        notifier.enqueue(
+            bot,
+            user_id,
+            f"❌ Your withdrawal request of ${refund:.2f} has been rejected. Funds returned to your balance."
+        )
 
 # Show Pending Invoices
 async def show_pending_invoices(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT invoice_id, user_id, amount, asset, status FROM payment_invoices WHERE status = 'active'")
-    rows = cursor.fetchall()
-    conn.close()
+    rows = fetchall("SELECT invoice_id, user_id, amount, asset, status FROM payment_invoices WHERE status = 'active'")
 
     if not rows:
-        await query.edit_message_text("✅ No unpaid deposit invoices.")
+        await edit_message(query, "✅ No unpaid deposit invoices.")
         return
-    await query.edit_message_text("📄 Showing unpaid invoices below:")
+    await edit_message(query, "📄 Showing unpaid invoices below:")
     
     for row in rows[:10]:
         invoice_id, user_id, amount, asset, status = row
@@ -85,7 +463,7 @@ async def show_pending_invoices(update: Update, context: ContextTypes.DEFAULT_TY
         f"💰 Amount: {amount} {asset} - *{status}*"
     )
     keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("🗑️ Delete", callback_data=f"delete_invoice_{invoice_id}")]
+        [InlineKeyboardButton("🗑️ Delete", callback_data=callback_data(Action.DELETE_INVOICE, invoice_id))]
     ])
     await query.message.reply_text(msg, reply_markup=keyboard, parse_mode="Markdown")
 
@@ -94,36 +472,20 @@ async def show_pending_invoices(update: Update, context: ContextTypes.DEFAULT_TY
 async def handle_approve_withdrawal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    request_id = int(query.data.split("_")[1])
-
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, amount, asset, wallet_address FROM withdrawal_requests WHERE request_id = ? AND status = 'pending'", (request_id,))
-    row = cursor.fetchone()
 
-    if not row:
-        await query.edit_message_text("⚠️ Request not found or already processed.")
+    if update.effective_user.id not in ADMIN_IDS:
+        await edit_message(query, "❌ You are not authorized to manage withdrawals.")
         return
 
-    user_id, amount, asset, wallet = row
+    request_id = int(context.args[0])
+    rows = approve_withdrawals([request_id])
 
-    cursor.execute(
-        "UPDATE withdrawal_requests SET status = 'completed', processed_at = datetime('now') WHERE request_id = ?",
-        (request_id,)
-    )
-    conn.commit()
-    conn.close()
-
-    await query.edit_message_text(f"✅ Withdrawal request #{request_id} approved.")
+    if not rows:
+        await edit_message(query, "⚠️ Request not found or already processed.")
+        return
 
-    try:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"✅ Your withdrawal of {amount} {asset} to `{wallet}` has been approved and processed.",
-            parse_mode="Markdown"
-        )
-    except Exception as e:
-        print(f"Failed to notify user {user_id}: {e}")
+    await edit_message(query, f"✅ Withdrawal request #{request_id} approved.")
+    withdrawals_processed(context, approved=rows)
 
 # Delete invoice (admin only)
 async def handle_delete_invoice(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -131,60 +493,48 @@ async def handle_delete_invoice(update: Update, context: ContextTypes.DEFAULT_TY
     await query.answer()
 
     if update.effective_user.id not in ADMIN_IDS:
-        await query.edit_message_text("❌ You are not authorized to delete invoices.")
+        await edit_message(query, "❌ You are not authorized to delete invoices.")
         return
 
-    invoice_id = query.data.split("_")[2]
+    invoice_id = context.args[0]
 
     # Delete from Crypto Pay API
-    response = requests.post(
-        f"{CRYPTO_PAY_API_BASE}/deleteInvoice",
-        headers=HEADERS,
-        json={"invoice_id": int(invoice_id)}
-    )
+    try:
+        await crypto_pay.delete_invoice(invoice_id)
+    except CryptoPayError as e:
+        await edit_message(query, f"❌ Failed to delete invoice `{invoice_id}`.\n\nError: {e}", parse_mode="Markdown")
+        return
 
-    if response.status_code == 200 and response.json().get("ok"):
-        # Update DB to reflect deletion
-        conn = sqlite3.connect("referral_bot.db")
-        cursor = conn.cursor()
-        cursor.execute("UPDATE payment_invoices SET status = 'deleted' WHERE invoice_id = ?", (invoice_id,))
-        conn.commit()
-        conn.close()
+    # Update DB to reflect deletion
+    execute("UPDATE payment_invoices SET status = 'deleted' WHERE invoice_id = ?", (invoice_id,))
 
-        await query.edit_message_text(f"✅ Invoice `{invoice_id}` has been successfully deleted.", parse_mode="Markdown")
-    else:
-        await query.edit_message_text(f"❌ Failed to delete invoice `{invoice_id}`.\n\nError: {response.text}", parse_mode="Markdown")
+    await edit_message(query, f"✅ Invoice `{invoice_id}` has been successfully deleted.", parse_mode="Markdown")
 
 # Reject Withdrawal
 async def handle_reject_withdrawal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    request_id = int(query.data.split("_")[1])
-
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
 
-    # Return funds to user balance
-    cursor.execute("SELECT user_id, amount FROM withdrawal_requests WHERE request_id = ? AND status = 'pending'", (request_id,))
-    row = cursor.fetchone()
-
-    if not row:
-        await query.edit_message_text("⚠️ Request not found or already processed.")
+    if update.effective_user.id not in ADMIN_IDS:
+        await edit_message(query, "❌ You are not authorized to manage withdrawals.")
         return
 
-    user_id, amount = row
+    request_id = int(context.args[0])
+    # A failed payout may have gone through after all: never refund a paid one
+    try:
+        paid = await settle_failed_payouts(context.bot, [request_id])
+    except CryptoPayError as e:
+        await edit_message(query, f"⚠️ Could not check Crypto Pay for a transfer of #{request_id}; nothing was refunded.\n\nError: {e}")
+        return
+    if paid:
+        await edit_message(query, f"✅ Withdrawal request #{request_id} was paid after all; marked completed, nothing refunded.")
+        return
 
-    cursor.execute("UPDATE users SET earning_amount = earning_amount + ? WHERE user_id = ?", (amount, user_id))
-    cursor.execute("UPDATE withdrawal_requests SET status = 'rejected', processed_at = datetime('now') WHERE request_id = ?", (request_id,))
-    conn.commit()
-    conn.close()
+    rows = reject_withdrawals([request_id])
 
-    await query.edit_message_text(f"❌ Withdrawal request #{request_id} rejected and funds returned to user.")
+    if not rows:
+        await edit_message(query, "⚠️ Request not found or already processed.")
+        return
 
-    try:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"❌ Your withdrawal request of ${amount} has been rejected. Funds returned to your balance."
-        )
-    except Exception as e:
-        print(f"Failed to notify user {user_id}: {e}")
+    await edit_message(query, f"❌ Withdrawal request #{request_id} rejected and funds returned to user.")
+    withdrawals_processed(context, rejected=rows)
@@ -0,0 +1,183 @@
+import logging
+from time import perf_counter
+from config import ADMIN_IDS
+from throttle import UserThrottle, THROTTLE_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+# callback_data format: <version><action>[:<arg>...]
+# e.g. "1d" (deposit menu), "1da:BTC" (deposit BTC), "1r:a:12345" (referrals after 12345).
+# Bump CALLBACK_VERSION if the encoding changes; buttons from older
+# versions then fall back to decode_legacy or are rejected.
+CALLBACK_VERSION = "1"
+SEPARATOR = ":"
+MAX_CALLBACK_DATA = 64  # Telegram limit in bytes
+
+
+class Action:
+    """Action codes packed into callback_data."""
+    MAIN_MENU = "m"
+    ACCOUNT = "a"
+    REFERRALS = "r"
+    DEPOSIT = "d"
+    DEPOSIT_ASSET = "da"
+    CHECK_DEPOSIT = "cd"
+    WITHDRAW = "w"
+    WITHDRAW_ASSET = "wa"
+    DAILY_BONUS = "b"
+    CLAIM_BONUS = "cb"
+    ADMIN_WITHDRAWALS = "aw"
+    ADMIN_INVOICES = "ai"
+    APPROVE_WITHDRAWAL = "ap"
+    REJECT_WITHDRAWAL = "rj"
+    DELETE_INVOICE = "di"
+    TOGGLE_WITHDRAWAL = "wt"
+    CLEAR_SELECTION = "wc"
+    APPROVE_SELECTED = "as"
+    REJECT_SELECTED = "rs"
+    APPROVE_UNDER = "au"
+    HISTORY = "h"
+
+
+def callback_data(action, *args):
+    """Encode an action and its arguments as compact callback_data."""
+    data = CALLBACK_VERSION + action + "".join(SEPARATOR + str(arg) for arg in args)
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data too long: {data}")
+    return data
+
+
+# Buttons sent before the compact encoding existed
+LEGACY_ACTIONS = {
+    "back_to_main": Action.MAIN_MENU,
+    "account": Action.ACCOUNT,
+    "referrals": Action.REFERRALS,
+    "deposit": Action.DEPOSIT,
+    "withdraw": Action.WITHDRAW,
+    "daily_bonus": Action.DAILY_BONUS,
+    "claim_bonus": Action.CLAIM_BONUS,
+    "admin_withdrawals": Action.ADMIN_WITHDRAWALS,
+    "admin_invoices": Action.ADMIN_INVOICES,
+}
+LEGACY_PREFIXES = (
+    ("deposit_asset_", Action.DEPOSIT_ASSET, ()),
+    ("withdraw_asset_", Action.WITHDRAW_ASSET, ()),
+    ("check_deposit_", Action.CHECK_DEPOSIT, ()),
+    ("delete_invoice_", Action.DELETE_INVOICE, ()),
+    ("approve_", Action.APPROVE_WITHDRAWAL, ()),
+    ("reject_", Action.REJECT_WITHDRAWAL, ()),
+    ("referrals_after_", Action.REFERRALS, ("a",)),
+    ("referrals_before_", Action.REFERRALS, ("b",)),
+)
+
+
+def decode_legacy(data):
+    if data in LEGACY_ACTIONS:
+        return LEGACY_ACTIONS[data], []
+    for prefix, action, args in LEGACY_PREFIXES:
+        if data.startswith(prefix):
+            return action, [*args, data[len(prefix):]]
+    return None, None
+
+
+def decode(data):
+    """Return (action, args) for callback_data, or (None, None) if unknown."""
+    if not data:
+        return None, None
+    if data.startswith(CALLBACK_VERSION):
+        head, *args = data.split(SEPARATOR)
+        return head[len(CALLBACK_VERSION):], args
+    return decode_legacy(data)
+
+
+class RouteStats:
+    __slots__ = ("count", "errors", "throttled", "total_time", "max_time")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.throttled = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+class CallbackRouter:
+    """Dispatches every callback query through one dict lookup.
+
+    Handlers keep the usual ``(update, context)`` signature and read their
+    decoded arguments from ``context.args``, like command handlers do.
+
+    Every press first takes ``cost`` tokens from the user's bucket in
+    ``throttle``; presses over the limit only get a toast, so flooding a
+    button costs one answerCallbackQuery and no handler work. The update
+    processor calls ``admit`` for this before the press queues behind the
+    user's other updates, so the toast is never late.
+    """
+
+    def __init__(self, throttle=None):
+        self._routes = {}
+        self._costs = {}
+        self.stats = {}
+        self.throttle = throttle
+
+    def add(self, action, handler, cost=1):
+        if action in self._routes:
+            raise ValueError(f"Callback action {action!r} is already routed")
+        self._routes[action] = handler
+        self._costs[action] = cost
+        self.stats[action] = RouteStats()
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        action, args = decode(query.data)
+        handler = self._routes.get(action)
+
+        if handler is None:
+            logger.warning(f"Unroutable callback_data: {query.data!r}")
+            await query.answer()
+            return
+
+        stats = self.stats[action]
+        context.args = args
+        started = perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = perf_counter() - started
+            stats.count += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+
+    async def admit(self, update):
+        """Charge a button press to the user's bucket.
+
+        Returns False, after answering with THROTTLE_MESSAGE, if the press
+        is over the limit and must be dropped.
+        """
+        query = update.callback_query
+        if query is None or self.throttle is None:
+            return True
+        action, _ = decode(query.data)
+        if action not in self._routes or self.throttle.allow(query.from_user.id, self._costs[action]):
+            return True
+        self.stats[action].throttled += 1
+        await query.answer(THROTTLE_MESSAGE)
+        return False
+
+    def report(self):
+        """One line per route: name, calls, errors, mean and max latency."""
+        names = {code: name for name, code in vars(Action).items() if not name.startswith("_")}
+        lines = []
+        for action, stats in sorted(self.stats.items(), key=lambda item: -item[1].count):
+            mean_ms = stats.total_time / stats.count * 1000 if stats.count else 0.0
+            lines.append(
+                f"{names.get(action, action)}: {stats.count} calls, {stats.errors} errors, {stats.throttled} throttled, "
+                f"avg {mean_ms:.1f} ms, max {stats.max_time * 1000:.1f} ms"
+            )
+        return "\n".join(lines)
+
+
+router = CallbackRouter(throttle=UserThrottle(exempt=ADMIN_IDS))
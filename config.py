@@ -0,0 +1,15 @@
+# Settings shared across modules. Kept free of imports from the rest of
+# the bot so any module can import it at load time.
+
+ADMIN_IDS = [1075995888]  # <--- Replace with your Telegram ID
+
+# Tier configuration
+TIERS = {
+    'Bronze': {'min_deposit': 0, 'referral_bonus': 5},       # 5% referral bonus
+    'Silver': {'min_deposit': 50, 'referral_bonus': 15},    # 15% referral bonus
+    'Gold': {'min_deposit': 150, 'referral_bonus': 25}, # 25% referral bonus
+    'Diamond': {'min_deposit':500, 'referral_bonus':40}   # 40% referral bonus           
+}
+
+# (min_deposit, tier) from the highest threshold down
+TIER_THRESHOLDS = sorted(((tier['min_deposit'], name) for name, tier in TIERS.items()), reverse=True)
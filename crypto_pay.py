@@ -0,0 +1,140 @@
+import logging
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Connection pool shared by every request to the same host
+POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30)
+
+# Per-endpoint timeouts in seconds. Reads that users wait on are kept short;
+# anything not listed falls back to DEFAULT_TIMEOUT.
+DEFAULT_TIMEOUT = 10
+ENDPOINT_TIMEOUTS = {
+    "getMe": 5,
+    "getAssets": 5,
+    "getInvoices": 8,
+    "createInvoice": 10,
+    "deleteInvoice": 8,
+    "transfer": 15,
+    "getTransfers": 8,
+    "quotes": 8,
+}
+
+
+class CryptoPayError(Exception):
+    """Raised when Crypto Pay or CoinMarketCap returns an error or cannot be reached.
+
+    ``name`` is the API error name (e.g. ``INSUFFICIENT_FUNDS``), or None if
+    the request never got an answer.
+    """
+
+    def __init__(self, message, name=None):
+        super().__init__(message)
+        self.name = name
+
+
+class CryptoPayClient:
+    """Async Crypto Pay API client over a persistent keep-alive connection pool."""
+
+    def __init__(self, api_token, base_url):
+        self.api_token = api_token
+        self.base_url = base_url
+        self._client = None
+
+    @property
+    def client(self):
+        # Created lazily so the client binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Crypto-Pay-API-Token": self.api_token or ""},
+                limits=POOL_LIMITS,
+                timeout=DEFAULT_TIMEOUT,
+            )
+        return self._client
+
+    async def call(self, method, **params):
+        """Call an API method and return its ``result`` payload."""
+        timeout = ENDPOINT_TIMEOUTS.get(method, DEFAULT_TIMEOUT)
+        try:
+            response = await self.client.post(f"/{method}", json=params, timeout=timeout)
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise CryptoPayError(f"{method} failed: {e}") from e
+
+        if response.status_code != 200 or not data.get("ok"):
+            error = data.get("error", response.text)
+            name = error.get("name") if isinstance(error, dict) else None
+            raise CryptoPayError(f"{method} failed: {error}", name=name)
+        return data.get("result")
+
+    async def get_me(self):
+        return await self.call("getMe")
+
+    async def get_assets(self):
+        return await self.call("getAssets")
+
+    async def create_invoice(self, **params):
+        return await self.call("createInvoice", **params)
+
+    async def get_invoices(self, **params):
+        return await self.call("getInvoices", **params)
+
+    async def delete_invoice(self, invoice_id):
+        return await self.call("deleteInvoice", invoice_id=int(invoice_id))
+
+    async def transfer(self, **params):
+        return await self.call("transfer", **params)
+
+    async def get_transfers(self, **params):
+        return await self.call("getTransfers", **params)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class CoinMarketCapClient:
+    """Async CoinMarketCap quotes client over a persistent connection pool."""
+
+    def __init__(self, api_key, quotes_url):
+        self.api_key = api_key
+        self.quotes_url = quotes_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers={"Accepts": "application/json", "X-CMC_PRO_API_KEY": self.api_key or ""},
+                limits=POOL_LIMITS,
+                timeout=DEFAULT_TIMEOUT,
+            )
+        return self._client
+
+    async def quotes(self, symbols, convert="USD"):
+        """Return ``{symbol: price}`` for one or more comma-separated symbols."""
+        if not isinstance(symbols, str):
+            symbols = ",".join(symbols)
+        try:
+            response = await self.client.get(
+                self.quotes_url,
+                params={"symbol": symbols, "convert": convert},
+                timeout=ENDPOINT_TIMEOUTS["quotes"],
+            )
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise CryptoPayError(f"CoinMarketCap quotes failed: {e}") from e
+
+        if response.status_code != 200 or "data" not in data:
+            raise CryptoPayError(f"CoinMarketCap quotes failed: {data}")
+        return {
+            symbol: entry["quote"][convert]["price"]
+            for symbol, entry in data["data"].items()
+        }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,135 @@
+import argparse
+import itertools
+import json
+import logging
+from datetime import datetime, timezone
+import tornado.ioloop
+import tornado.web
+
+logger = logging.getLogger(__name__)
+
+# A local stand-in for the parts of the Crypto Pay API the payout worker
+# uses (getMe, transfer, getTransfers), for exercising payouts without
+# real funds. Run it and point the bot at it:
+#
+#     python crypto_pay_standin.py --port 8800 --lose-responses 5
+#     CRYPTO_PAY_API_BASE=http://127.0.0.1:8800/api python main.py
+#
+# Transfers are kept in memory and spend_id is enforced like the real API
+# (SPEND_ID_ALREADY_USED). Failure modes:
+#   --lose-responses N  the first N transfer calls are carried out, but
+#                       answered with a 502 as if the response was lost
+#   --refuse N          the first N transfer calls fail with a 502 and
+#                       transfer nothing
+#   --insufficient N    the first N transfer calls fail with INSUFFICIENT_FUNDS
+STANDIN_PORT = 8800
+
+
+class Ledger:
+    def __init__(self, lose_responses=0, refuse=0, insufficient=0):
+        self.transfers = []
+        self.lose_responses = lose_responses
+        self.refuse = refuse
+        self.insufficient = insufficient
+        self._ids = itertools.count(1)
+
+    def transfer(self, params):
+        """Returns (status, payload) for a transfer call."""
+        if self.refuse > 0:
+            self.refuse -= 1
+            return 502, None
+        if self.insufficient > 0:
+            self.insufficient -= 1
+            return 400, _error(400, "INSUFFICIENT_FUNDS")
+
+        spend_id = params.get("spend_id")
+        existing = spend_id and next((t for t in self.transfers if t["spend_id"] == spend_id), None)
+        if existing is None:
+            existing = {
+                "transfer_id": next(self._ids),
+                "spend_id": spend_id,
+                "user_id": params.get("user_id"),
+                "asset": params.get("asset"),
+                "amount": params.get("amount"),
+                "status": "completed",
+                "completed_at": datetime.now(timezone.utc).isoformat(),
+                "comment": params.get("comment"),
+            }
+            self.transfers.append(existing)
+            logger.info(f"Transfer {existing['transfer_id']}: {existing['amount']} {existing['asset']} to {existing['user_id']}")
+            duplicate = False
+        else:
+            duplicate = True
+
+        if self.lose_responses > 0:
+            self.lose_responses -= 1
+            return 502, None
+        if duplicate:
+            return 400, _error(400, "SPEND_ID_ALREADY_USED")
+        return 200, {"ok": True, "result": existing}
+
+    def get_transfers(self, params):
+        items = self.transfers
+        if params.get("spend_id"):
+            items = [t for t in items if t["spend_id"] == params["spend_id"]]
+        if params.get("asset"):
+            items = [t for t in items if t["asset"] == params["asset"]]
+        if params.get("transfer_ids"):
+            wanted = {int(i) for i in str(params["transfer_ids"]).split(",")}
+            items = [t for t in items if t["transfer_id"] in wanted]
+        offset = int(params.get("offset", 0))
+        count = int(params.get("count", 100))
+        return 200, {"ok": True, "result": {"items": items[offset:offset + count]}}
+
+
+def _error(code, name):
+    return {"ok": False, "error": {"code": code, "name": name}}
+
+
+class ApiHandler(tornado.web.RequestHandler):
+    def initialize(self, ledger):
+        self.ledger = ledger
+
+    def post(self, method):
+        try:
+            params = json.loads(self.request.body or b"{}")
+        except ValueError:
+            params = {}
+
+        if method == "getMe":
+            status, payload = 200, {"ok": True, "result": {"app_id": 1, "name": "Crypto Pay stand-in"}}
+        elif method == "transfer":
+            status, payload = self.ledger.transfer(params)
+        elif method == "getTransfers":
+            status, payload = self.ledger.get_transfers(params)
+        else:
+            status, payload = 405, _error(405, "METHOD_NOT_FOUND")
+
+        self.set_status(status)
+        if payload is None:
+            self.write("Bad Gateway")
+        else:
+            self.set_header("Content-Type", "application/json")
+            self.write(json.dumps(payload))
+
+
+def make_app(ledger):
+    return tornado.web.Application([(r"/api/(\w+)", ApiHandler, {"ledger": ledger})])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Crypto Pay stand-in for payout testing")
+    parser.add_argument("--port", type=int, default=STANDIN_PORT)
+    parser.add_argument("--lose-responses", type=int, default=0)
+    parser.add_argument("--refuse", type=int, default=0)
+    parser.add_argument("--insufficient", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    make_app(Ledger(args.lose_responses, args.refuse, args.insufficient)).listen(args.port, address="127.0.0.1")
+    logger.info(f"Crypto Pay stand-in listening on http://127.0.0.1:{args.port}/api")
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == "__main__":
+    main()
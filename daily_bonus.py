@@ -1,13 +1,13 @@
 import logging
-import sqlite3
 import random
 from datetime import datetime, timedelta
+from database import transaction, fetchone, execute
+from rendering import edit_message
+from callbacks import Action, callback_data, router
+from user_cache import claim_cache, invalidate_user
+import ledger
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import (
-    ContextTypes,
-    CommandHandler,
-    CallbackQueryHandler
-)
+from telegram.ext import ContextTypes
 
 logger = logging.getLogger(__name__)
 
@@ -21,14 +21,13 @@ BONUS_TIERS = {
 # Maximum free bonus amount - after this, users need to deposit to keep getting bonuses
 MAX_FREE_BONUS_TOTAL = 25.0
 MIN_REQUIRED_DEPOSIT = 50.0
+# A repeated Claim press this soon after a claim is shown that claim again
+CLAIM_REPLAY_SECONDS = 10
 
 def setup_daily_bonus_database():
     """Set up database tables for daily bonus system."""
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    
     # Create daily_claims table to track when users claimed their daily bonus
-    cursor.execute('''
+    execute('''
     CREATE TABLE IF NOT EXISTS daily_claims (
         user_id INTEGER PRIMARY KEY,
         last_claim_date TEXT,
@@ -38,9 +37,6 @@ def setup_daily_bonus_database():
         FOREIGN KEY (user_id) REFERENCES users(user_id)
     )
     ''')
-    
-    conn.commit()
-    conn.close()
 
 def calculate_bonus(tier, streak_days):
     """Return a random bonus amount within the tier range, boosted by streak."""
@@ -53,143 +49,122 @@ def calculate_bonus(tier, streak_days):
     
     return round(min(total, max_bonus), 3)
 
+# Claim status and the user's tier/deposit in one primary-key read
+CLAIM_STATUS_SQL = """
+SELECT u.deposit_micros / 1e6, u.tier, c.last_claim_date, c.total_claimed, c.eligible_for_free_bonus, c.streak_days
+FROM users u LEFT JOIN daily_claims c ON c.user_id = u.user_id
+WHERE u.user_id = ?
+"""
+
+def _claim_status_from_row(user_id, row):
+    if not row:
+        return None
+    deposit_amount, tier, last_claim_date, total_claimed, eligible, streak_days = row
+    return {
+        'user_id': user_id,
+        'last_claim_date': datetime.strptime(last_claim_date, "%Y-%m-%d %H:%M:%S") if last_claim_date else None,
+        'total_claimed': total_claimed or 0.0,
+        'eligible_for_free_bonus': bool(eligible) if eligible is not None else True,
+        'streak_days': streak_days or 0,
+        'deposit_amount': deposit_amount or 0.0,
+        'tier': tier or 'Bronze'
+    }
+
 def get_user_claim_status(user_id):
-    """Get information about a user's daily claim status."""
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
+    """Get information about a user's daily claim status, cached between writes."""
+    status = claim_cache.get(user_id)
+    if status is not None:
+        return status
     
-    cursor.execute("SELECT * FROM daily_claims WHERE user_id = ?", (user_id,))
-    claim_data = cursor.fetchone()
+    status = _claim_status_from_row(user_id, fetchone(CLAIM_STATUS_SQL, (user_id,)))
     
-    # Also get user deposit info to check eligibility
-    cursor.execute("SELECT deposit_amount FROM users WHERE user_id = ?", (user_id,))
-    user_data = cursor.fetchone()
-    
-    conn.close()
-    
-    # Default values if no previous claims
-    if not claim_data:
+    # Default values if the user is not registered yet
+    if status is None:
         return {
             'user_id': user_id,
             'last_claim_date': None,
             'total_claimed': 0.0,
             'eligible_for_free_bonus': True,
-            'deposit_amount': user_data[0] if user_data else 0.0
+            'streak_days': 0,
+            'deposit_amount': 0.0,
+            'tier': 'Bronze'
         }
-    
-    return {
-        'user_id': claim_data[0],
-        'last_claim_date': datetime.strptime(claim_data[1], "%Y-%m-%d %H:%M:%S") if claim_data[1] else None,
-        'total_claimed': claim_data[2],
-        'eligible_for_free_bonus': bool(claim_data[3]),
-        'deposit_amount': user_data[0] if user_data else 0.0
-    }
+    claim_cache.set(user_id, status)
+    return status
 
-def can_claim_daily_bonus(user_id):
-    """Check if a user can claim their daily bonus."""
-    claim_status = get_user_claim_status(user_id)
+def check_claim_eligibility(claim_status, now=None):
+    """Return (can_claim, deposit_required) for a claim status dict."""
+    now = now or datetime.now()
+    
+    # Check if user has reached the free bonus limit and needs to deposit
+    deposit_required = (
+        claim_status['total_claimed'] >= MAX_FREE_BONUS_TOTAL
+        and claim_status['eligible_for_free_bonus']
+        and claim_status['deposit_amount'] < MIN_REQUIRED_DEPOSIT
+    )
     
     # First-time claimer
     if claim_status['last_claim_date'] is None:
-        return True
+        return not deposit_required, deposit_required
     
     # Check if 24 hours have passed since last claim
-    now = datetime.now()
-    time_since_last_claim = now - claim_status['last_claim_date']
+    if now - claim_status['last_claim_date'] < timedelta(hours=24):
+        return False, deposit_required
     
-    if time_since_last_claim < timedelta(hours=24):
-        return False
-    
-    # Check if user has reached the free bonus limit and needs to deposit
-    if claim_status['total_claimed'] >= MAX_FREE_BONUS_TOTAL and claim_status['eligible_for_free_bonus']:
-        # If user has deposited enough, they can continue getting bonuses
-        if claim_status['deposit_amount'] >= MIN_REQUIRED_DEPOSIT:
-            # Update their eligibility status
-            conn = sqlite3.connect('referral_bot.db')
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE daily_claims SET eligible_for_free_bonus = 0 WHERE user_id = ?", 
-                (user_id,)
-            )
-            conn.commit()
-            conn.close()
-            return True
-        else:
-            # User needs to deposit more
-            return False
-    
-    return True
+    return not deposit_required, deposit_required
 
-def get_bonus_amount(user_id, streak_days):
-    """Get the randomized bonus amount based on user's tier and streak."""
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT tier FROM users WHERE user_id = ?", (user_id,))
-    user_data = cursor.fetchone()
-    
-    conn.close()
-    
-    tier= user_data[0] if user_data else 'Bronze' # Default to Bronze tier
-    
-    return calculate_bonus(tier, streak_days)
+def claim_bonus(user_id):
+    """Claim the daily bonus in one BEGIN IMMEDIATE transaction.
 
-def update_last_claim(user_id, bonus_amount):
-    """Update the user's streak, claim time, and earnings."""
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    # Check if user already exists in daily_claims
-    cursor.execute("SELECT last_claim_date, streak_days FROM daily_claims WHERE user_id = ?", (user_id,))
-    record = cursor.fetchone()
+    Eligibility, streak, bonus amount, balance credit and the transaction
+    row are all decided under the write lock, so two concurrent presses
+    cannot both claim. A successful claim returns its ``claimed_at`` and a
+    too-soon one the ``last_claim_date`` it collided with, both as stored.
+    """
+    now = datetime.now()
+    now_str = now.strftime("%Y-%m-%d %H:%M:%S")
     
-    if record:
-        last_claim = datetime.strptime(record[0], "%Y-%m-%d %H:%M:%S") if record[0] else None
-        current_streak = record[1] or 0
+    with transaction(immediate=True) as conn:
+        claim_status = _claim_status_from_row(user_id, conn.execute(CLAIM_STATUS_SQL, (user_id,)).fetchone())
+        if claim_status is None:
+            return {"success": False, "reason": "not_registered"}
         
+        can_claim, deposit_required = check_claim_eligibility(claim_status, now)
+        if not can_claim:
+            if deposit_required:
+                return {"success": False, "reason": "deposit_required"}
+            return {"success": False, "reason": "too_soon",
+                    "last_claim_date": claim_status['last_claim_date'].strftime("%Y-%m-%d %H:%M:%S")}
+        
+        # Users past the free limit who deposited enough keep claiming as depositors
+        eligible_for_free_bonus = claim_status['eligible_for_free_bonus']
+        if claim_status['total_claimed'] >= MAX_FREE_BONUS_TOTAL and eligible_for_free_bonus:
+            eligible_for_free_bonus = False
+        
+        last_claim = claim_status['last_claim_date']
         if last_claim and last_claim.date() == (now - timedelta(days=1)).date():
-            new_streak = current_streak + 1
+            new_streak = claim_status['streak_days'] + 1
         else:
             new_streak = 1
-
-        cursor.execute(
-            "UPDATE daily_claims SET last_claim_date = ?, total_claimed = total_claimed + ?, streak_days = ? WHERE user_id = ?",
-            (now, bonus_amount, new_streak, user_id)
+        
+        bonus_amount = calculate_bonus(claim_status['tier'], new_streak - 1)
+        
+        conn.execute(
+            "INSERT INTO daily_claims (user_id, last_claim_date, total_claimed, eligible_for_free_bonus, streak_days) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET last_claim_date = excluded.last_claim_date, "
+            "total_claimed = total_claimed + excluded.total_claimed, "
+            "eligible_for_free_bonus = excluded.eligible_for_free_bonus, streak_days = excluded.streak_days",
+            (user_id, now_str, bonus_amount, int(eligible_for_free_bonus), new_streak)
         )
-    else:
-        new_streak = 1
-        cursor.execute(
-            "INSERT INTO daily_claims (user_id, last_claim_date, total_claimed, streak_days) VALUES (?, ?, ?, ?)",
-            (user_id, now, bonus_amount, new_streak)
+        ledger.post(conn, user_id, ledger.EARNING, bonus_amount, "daily_bonus")
+        conn.execute(
+            "INSERT INTO transactions (user_id, amount, type, timestamp) VALUES (?, ?, ?, ?)",
+            (user_id, bonus_amount, "daily_bonus", now_str)
         )
+    invalidate_user(user_id)
     
-    # Update user's earning amount
-    # Update user earnings
-    cursor.execute("SELECT earning_amount FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    if result:
-        new_earnings = result[0] + bonus_amount
-        cursor.execute("UPDATE users SET earning_amount = ? WHERE user_id = ?", (new_earnings, user_id))
-    
-    conn.commit()
-    conn.close()
-
-def add_daily_bonus_transaction(user_id, amount):
-    """Record a daily bonus transaction."""
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    cursor.execute(
-        "INSERT INTO transactions (user_id, amount, type, timestamp) VALUES (?, ?, ?, ?)",
-        (user_id, amount, "daily_bonus", timestamp)
-    )
-    
-    conn.commit()
-    conn.close()
+    return {"success": True, "bonus_amount": bonus_amount, "streak_days": new_streak, "claimed_at": now_str}
 
 async def check_daily_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check if daily bonus is available and show claim button if it is."""
@@ -197,8 +172,8 @@ async def check_daily_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = query.from_user.id
-    can_claim = can_claim_daily_bonus(user_id)
     claim_status = get_user_claim_status(user_id)
+    can_claim, deposit_required = check_claim_eligibility(claim_status)
     
     # Calculate time remaining until next claim if needed
     time_remaining_str = ""
@@ -211,16 +186,8 @@ async def check_daily_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
             hours = time_diff.seconds // 3600
             minutes = (time_diff.seconds % 3600) // 60
             time_remaining_str = f"⏳ Next claim available in: {hours}h {minutes}m"
-    claim_status = get_user_claim_status(user_id)
-    streak_days = claim_status.get("streak_days", 0)
-    bonus_amount = get_bonus_amount(user_id, streak_days)
     
-    # Check if user needs to deposit more
-    deposit_required = False
-    if claim_status['total_claimed'] >= MAX_FREE_BONUS_TOTAL and claim_status['eligible_for_free_bonus']:
-        if claim_status['deposit_amount'] < MIN_REQUIRED_DEPOSIT:
-            deposit_required = True
-    tier = claim_status.get("tier", "Bronze")
+    tier = claim_status['tier']
     bonus_range = BONUS_TIERS.get(tier, BONUS_TIERS["Bronze"])
     message = f"🎁 *Daily Bonus*\n\n"
     message += f"Your tier: *{tier}*\n"
@@ -237,14 +204,14 @@ async def check_daily_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = []
     
     if can_claim and not deposit_required:
-        keyboard.append([InlineKeyboardButton("🎁 Claim Daily Bonus", callback_data="claim_bonus")])
+        keyboard.append([InlineKeyboardButton("🎁 Claim Daily Bonus", callback_data=callback_data(Action.CLAIM_BONUS))])
     elif deposit_required:
-        keyboard.append([InlineKeyboardButton("💰 Make Deposit", callback_data="deposit")])
+        keyboard.append([InlineKeyboardButton("💰 Make Deposit", callback_data=callback_data(Action.DEPOSIT))])
     
-    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="back_to_main")])
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data=callback_data(Action.MAIN_MENU))])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(message, reply_markup=reply_markup, parse_mode="Markdown")
+    await edit_message(query, message, reply_markup=reply_markup, parse_mode="Markdown")
 
 async def claim_daily_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Process the daily bonus claim."""
@@ -252,37 +219,47 @@ async def claim_daily_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = query.from_user.id
-    can_claim = can_claim_daily_bonus(user_id)
-    
-    if not can_claim:
-        await query.edit_message_text(
+    # A short single-row write: run it on the loop thread like the other
+    # handlers' writes, together with its cache invalidation
+    result = claim_bonus(user_id)
+    
+    # A user's updates run one at a time, so a double press runs after the
+    # claim it repeats and finds it too soon: show that claim again instead
+    # of replacing the congratulation with "not eligible". user_data is
+    # persisted as JSON, so only plain values go in.
+    last_claim = context.user_data.get("last_bonus_claim")
+    if (result.get("reason") == "too_soon" and last_claim is not None
+            and last_claim["claimed_at"] == result["last_claim_date"]
+            and datetime.now() - datetime.strptime(last_claim["claimed_at"], "%Y-%m-%d %H:%M:%S")
+            < timedelta(seconds=CLAIM_REPLAY_SECONDS)):
+        result = last_claim
+    elif result["success"]:
+        context.user_data["last_bonus_claim"] = result
+    
+    if not result["success"]:
+        await edit_message(query,
             "Sorry, you're not eligible to claim a bonus right now. Please try again later.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="daily_bonus")]])
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=callback_data(Action.DAILY_BONUS))]])
         )
         return
     
-    claim_status = get_user_claim_status(user_id)
-    streak_days = claim_status.get("streak_days", 0)
-    bonus_amount = get_bonus_amount(user_id, streak_days)
+    bonus_amount = result["bonus_amount"]
     
     message = (f"🎉 Congratulations! You've claimed your daily bonus of ${bonus_amount:.2f}!\n\n"
               f"The bonus has been added to your balance. Come back in 24 hours to claim again!")
     
     keyboard = [
-        [InlineKeyboardButton("📊 My Account", callback_data="account")],
-        [InlineKeyboardButton("🔙 Back", callback_data="back_to_main")]
+        [InlineKeyboardButton("📊 My Account", callback_data=callback_data(Action.ACCOUNT))],
+        [InlineKeyboardButton("🔙 Back", callback_data=callback_data(Action.MAIN_MENU))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(message, reply_markup=reply_markup)
+    await edit_message(query, message, reply_markup=reply_markup)
 
 # Function to add handlers to main application
 def add_daily_bonus_handlers(application):
     """Add daily bonus handlers to the main application."""
-    application.add_handler(CallbackQueryHandler(check_daily_bonus, pattern="^daily_bonus$"))
-    application.add_handler(CallbackQueryHandler(claim_daily_bonus, pattern="^claim_bonus$"))
-    
-    # Set up database tables
-    setup_daily_bonus_database()
+    router.add(Action.DAILY_BONUS, check_daily_bonus)
+    router.add(Action.CLAIM_BONUS, claim_daily_bonus, cost=2)
     
     logger.info("Daily bonus system initialized")
\ No newline at end of file
@@ -0,0 +1,161 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Database configuration
+DB_PATH = os.getenv("DB_PATH", "referral_bot.db")
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 4))
+POOL_TIMEOUT = 10  # seconds to wait for a free connection
+STATEMENT_CACHE_SIZE = 256  # prepared statements kept per connection
+
+# Applied to every new connection. WAL lets readers run while the single
+# writer commits; busy_timeout makes writers wait instead of failing fast.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",     # 16 MB page cache
+    "PRAGMA mmap_size = 268435456",   # 256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections."""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # isolation_level=None: statements autocommit unless wrapped in
+        # transaction(), which issues BEGIN/COMMIT explicitly.
+        conn = sqlite3.connect(
+            self.path,
+            timeout=POOL_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        """Take an idle connection, opening a new one while under the limit."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError("Timed out waiting for a database connection")
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back any open transaction."""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put_nowait(conn)
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._created -= 1
+
+
+_pool = ConnectionPool(DB_PATH, POOL_SIZE)
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection for the duration of the block.
+
+    Never hold a connection across an ``await``; fetch what you need,
+    leave the block, then talk to Telegram.
+    """
+    conn = _pool.acquire()
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
+
+@contextmanager
+def transaction(immediate=False):
+    """Run the block in a single transaction on a pooled connection.
+
+    ``immediate=True`` takes the write lock up front (BEGIN IMMEDIATE), which
+    avoids deadlocking two read-then-write transactions against each other.
+    """
+    with connection() as conn:
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+
+@contextmanager
+def read_connection():
+    """A dedicated read-only connection outside the pool.
+
+    For long scans like exports: WAL gives the reader a consistent snapshot
+    without blocking writers, and the pool stays free for bot traffic.
+    """
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, timeout=POOL_TIMEOUT, check_same_thread=False)
+    try:
+        conn.execute("PRAGMA busy_timeout = 5000")
+        yield conn
+    finally:
+        conn.close()
+
+
+def fetchone(sql, params=()):
+    """Run a query and return its first row."""
+    with connection() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def fetchall(sql, params=()):
+    """Run a query and return all rows."""
+    with connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def execute(sql, params=()):
+    """Run a single write statement and return its cursor."""
+    with connection() as conn:
+        return conn.execute(sql, params)
+
+
+def close_pool():
+    """Close all pooled connections (used on shutdown)."""
+    _pool.close()
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from time import time
+
+from crypto_pay import CryptoPayError
+
+logger = logging.getLogger(__name__)
+
+
+class RateService:
+    """USD exchange rates for a fixed set of symbols, refreshed in one batched request.
+
+    Quotes are served from memory. Once a quote is older than ``ttl`` it is
+    still returned (stale-while-revalidate) while a refresh runs in the
+    background. Only a symbol that has never been fetched makes the caller
+    wait, and concurrent waiters share a single in-flight request.
+    """
+
+    def __init__(self, client, symbols, ttl=60):
+        self.client = client
+        self.symbols = tuple(symbols)
+        self.ttl = ttl
+        self._quotes = {}  # { symbol: (price, fetched_at) }
+        self._inflight = None
+
+    def refresh(self):
+        """Start a batched refresh, or join the one already running."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._fetch_all())
+        return self._inflight
+
+    async def _fetch_all(self):
+        try:
+            prices = await self.client.quotes(self.symbols)
+        except CryptoPayError as e:
+            logger.error(f"Exchange rate refresh failed: {e}")
+            return False
+
+        fetched_at = time()
+        for symbol, price in prices.items():
+            self._quotes[symbol] = (price, fetched_at)
+        return True
+
+    async def get_price(self, symbol):
+        """Return the USD price of ``symbol`` or None if it has never been fetched."""
+        quote = self._quotes.get(symbol)
+        if quote is None:
+            # Cold miss: wait on the shared request
+            await asyncio.shield(self.refresh())
+            quote = self._quotes.get(symbol)
+            return quote[0] if quote else None
+
+        if time() - quote[1] >= self.ttl:
+            self.refresh()
+        return quote[0]
+
+    def age(self, symbol):
+        """Seconds since ``symbol`` was last fetched, or None if it never was."""
+        quote = self._quotes.get(symbol)
+        return time() - quote[1] if quote else None
+
+    def ages(self):
+        """Age in seconds of every cached quote."""
+        now = time()
+        return {symbol: now - fetched_at for symbol, (_, fetched_at) in self._quotes.items()}
+
+    async def refresh_job(self, context):
+        """JobQueue callback that keeps every quote warm."""
+        await self.refresh()
@@ -0,0 +1,166 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+from database import read_connection
+
+logger = logging.getLogger(__name__)
+
+# Exports stream rows off a read-only cursor in a worker thread, encode them
+# straight into gzip files on disk and upload each file as soon as it is
+# complete. Memory use does not depend on the size of the export.
+EXPORT_FETCH_SIZE = 1000
+# Bot API uploads are capped at 50 MB; start a new part before that
+EXPORT_PART_BYTES = int(os.getenv("EXPORT_PART_BYTES", 45 * 1024 * 1024))
+EXPORT_FORMATS = ("csv", "jsonl")
+
+# Export name -> (table, columns, date column, filter column)
+EXPORTS = {
+    "transactions": (
+        "transactions",
+        ("id", "user_id", "amount", "type", "timestamp"),
+        "timestamp", "type"
+    ),
+    "invoices": (
+        "payment_invoices",
+        ("invoice_id", "user_id", "amount", "asset", "status", "type", "created_at", "paid_at"),
+        "created_at", "status"
+    ),
+    "withdrawals": (
+        "withdrawal_requests",
+        ("request_id", "user_id", "amount", "asset", "usd_amount", "wallet_address", "memo", "status",
+         "created_at", "processed_at", "transfer_id", "payout_error"),
+        "created_at", "status"
+    ),
+}
+
+
+def iter_rows(name, since=None, until=None, prefix=None):
+    """Yield the rows of an export lazily, in insertion order.
+
+    ``since``/``until`` are inclusive YYYY-MM-DD dates; ``prefix`` keeps rows
+    whose filter column (transaction type, or status) starts with it.
+    """
+    table, columns, date_column, filter_column = EXPORTS[name]
+    conditions, params = [], []
+    if since:
+        conditions.append(f"{date_column} >= ?")
+        params.append(since)
+    if until:
+        conditions.append(f"{date_column} < date(?, '+1 day')")
+        params.append(until)
+    if prefix:
+        conditions.append(f"substr({filter_column}, 1, ?) = ?")
+        params.extend((len(prefix), prefix))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with read_connection() as conn:
+        cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY rowid", params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+
+class _Part:
+    """One gzip file being written; tracks its compressed size."""
+
+    def __init__(self, path, fmt, columns):
+        self.path = path
+        self.rows = 0
+        self._raw = open(path, "wb")
+        self._text = io.TextIOWrapper(gzip.GzipFile(fileobj=self._raw, mode="wb"), encoding="utf-8", newline="")
+        self._columns = columns
+        if fmt == "csv":
+            writer = csv.writer(self._text)
+            writer.writerow(columns)
+            self._write = writer.writerow
+        else:
+            self._write = self._write_json
+
+    def _write_json(self, row):
+        self._text.write(json.dumps(dict(zip(self._columns, row)), ensure_ascii=False))
+        self._text.write("\n")
+
+    def write(self, row):
+        self._write(row)
+        self.rows += 1
+
+    @property
+    def size(self):
+        # Compressed bytes flushed so far; gzip buffers lag by a few KB
+        return self._raw.tell()
+
+    def close(self):
+        self._text.close()
+        self._raw.close()
+
+
+def write_parts(rows, directory, basename, fmt, columns, part_bytes=EXPORT_PART_BYTES):
+    """Encode ``rows`` into gzip files of at most ~``part_bytes`` each.
+
+    A generator: yields (path, row count) as each part is finished, so the
+    caller can upload it while the next one is written.
+    """
+    extension = "csv" if fmt == "csv" else "jsonl"
+    number = 0
+    part = None
+    try:
+        for row in rows:
+            if part is None:
+                number += 1
+                part = _Part(os.path.join(directory, f"{basename}.part{number}.{extension}.gz"), fmt, columns)
+            part.write(row)
+            if part.size >= part_bytes:
+                part.close()
+                finished, part = part, None
+                yield finished.path, finished.rows
+    except GeneratorExit:
+        if part is not None:
+            part.close()
+        raise
+    if part is not None:
+        part.close()
+        yield part.path, part.rows
+    elif number == 0:
+        # Nothing matched: still deliver a (header-only) file
+        part = _Part(os.path.join(directory, f"{basename}.{extension}.gz"), fmt, columns)
+        part.close()
+        yield part.path, 0
+
+
+async def export_table(name, fmt, send_part, since=None, until=None, prefix=None):
+    """Export ``name`` as gzip ``fmt`` files, awaiting ``send_part(path, rows)`` per part.
+
+    Reading and compression run in worker threads so the event loop keeps
+    serving updates. Returns (rows, parts).
+    """
+    _, columns, _, _ = EXPORTS[name]
+    basename = "_".join(filter(None, (name, prefix, since, until)))
+    total_rows = parts = 0
+
+    with tempfile.TemporaryDirectory(prefix="export-") as directory:
+        rows_iter = iter_rows(name, since, until, prefix)
+        generator = write_parts(rows_iter, directory, basename, fmt, columns)
+        try:
+            while True:
+                part = await asyncio.to_thread(next, generator, None)
+                if part is None:
+                    break
+                path, rows = part
+                await send_part(path, rows)
+                os.remove(path)
+                total_rows += rows
+                parts += 1
+        finally:
+            # Closes the part and the read connection if the upload failed midway
+            await asyncio.to_thread(generator.close)
+            await asyncio.to_thread(rows_iter.close)
+
+    logger.info(f"Exported {total_rows} {name} rows in {parts} parts ({fmt})")
+    return total_rows, parts
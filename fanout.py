@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+from time import monotonic
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from user_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second per bot and about one per
+# second per chat. Every message the bot sends on its own (notifications,
+# broadcasts) goes through the shared notifier below so they all draw from
+# the same budget.
+GLOBAL_RATE = float(os.getenv("SEND_RATE", 28))          # messages per second
+PER_CHAT_INTERVAL = 1.0                                    # seconds between messages to one chat
+MAX_CONCURRENT_SENDS = int(os.getenv("SEND_CONCURRENCY", 20))
+MAX_RETRIES = 3
+
+# Broadcasts run a little below GLOBAL_RATE so notifications still get through
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+BROADCAST_WORKERS = 20
+
+# Workers draining the background notification queue
+QUEUE_WORKERS = 4
+
+SENT, BLOCKED, FAILED = "sent", "blocked", "failed"
+
+
+class TokenBucket:
+    """Async token bucket; waiters are served in FIFO order."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Hand out no tokens for ``seconds`` (after a RetryAfter)."""
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastProgress:
+    __slots__ = ("total", "sent", "blocked", "failed", "started_at", "finished_at")
+
+    def __init__(self, total=None):
+        self.total = total
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+        self.started_at = monotonic()
+        self.finished_at = None
+
+    @property
+    def processed(self):
+        return self.sent + self.blocked + self.failed
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    @property
+    def rate(self):
+        elapsed = (self.finished_at or monotonic()) - self.started_at
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        total = self.total if self.total is not None else "?"
+        return (
+            f"{self.processed}/{total} processed at {self.rate:.1f} msg/s\n"
+            f"✅ Sent: {self.sent}\n"
+            f"🚫 Blocked: {self.blocked}\n"
+            f"⚠️ Failed: {self.failed}"
+        )
+
+
+class FanOut:
+    """Sends messages within Telegram's global and per-chat rate limits.
+
+    Concurrency is bounded, RetryAfter pauses every sender for the time
+    Telegram asks for, and transient network errors are retried.
+    """
+
+    def __init__(self, rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL, concurrency=MAX_CONCURRENT_SENDS):
+        self._bucket = TokenBucket(rate)
+        self._per_chat_interval = per_chat_interval
+        self._chat_next = LRUCache(maxsize=50000, ttl=60)   # { chat_id: next allowed send time }
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queue = None
+        self._queue_workers = []
+
+    async def _wait_for_chat(self, chat_id):
+        now = monotonic()
+        ready = self._chat_next.get(chat_id) or now
+        self._chat_next.set(chat_id, max(now, ready) + self._per_chat_interval)
+        if ready > now:
+            await asyncio.sleep(ready - now)
+
+    async def _deliver(self, bot, chat_id, text, **kwargs):
+        """Returns (status, message)."""
+        async with self._semaphore:
+            for attempt in range(MAX_RETRIES + 1):
+                await self._wait_for_chat(chat_id)
+                await self._bucket.acquire()
+                try:
+                    return SENT, await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                except RetryAfter as e:
+                    logger.warning(f"Flood control: pausing all sends for {e.retry_after}s")
+                    self._bucket.pause(e.retry_after)
+                except Forbidden:
+                    # User blocked the bot or deleted their account
+                    return BLOCKED, None
+                except BadRequest as e:
+                    logger.error(f"Failed to send message to {chat_id}: {e}")
+                    return FAILED, None
+                except NetworkError as e:
+                    if attempt < MAX_RETRIES:
+                        await asyncio.sleep(2 ** attempt)
+                    else:
+                        logger.error(f"Failed to send message to {chat_id}: {e}")
+                except TelegramError as e:
+                    logger.error(f"Failed to send message to {chat_id}: {e}")
+                    return FAILED, None
+        return FAILED, None
+
+    async def send(self, bot, chat_id, text, **kwargs):
+        """send_message within the rate limits. Returns the Message, or None on failure."""
+        status, message = await self._deliver(bot, chat_id, text, **kwargs)
+        if status == BLOCKED:
+            logger.info(f"Chat {chat_id} has blocked the bot")
+        return message
+
+    async def send_many(self, bot, chat_ids, text, **kwargs):
+        """Send the same message to a few chats concurrently."""
+        return await asyncio.gather(*(self.send(bot, chat_id, text, **kwargs) for chat_id in chat_ids))
+
+    def enqueue(self, bot, chat_id, text, **kwargs):
+        """Queue a message to be sent in the background and return immediately."""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._queue_workers = [asyncio.create_task(self._drain_queue()) for _ in range(QUEUE_WORKERS)]
+        self._queue.put_nowait((bot, chat_id, text, kwargs))
+
+    async def _drain_queue(self):
+        while True:
+            bot, chat_id, text, kwargs = await self._queue.get()
+            try:
+                await self.send(bot, chat_id, text, **kwargs)
+            except Exception as e:
+                logger.error(f"Queued message to {chat_id} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def close(self, timeout=10):
+        """Wait up to ``timeout`` seconds for queued messages, then stop the workers."""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self._queue.qsize()} queued messages at shutdown")
+        for task in self._queue_workers:
+            task.cancel()
+        self._queue = None
+        self._queue_workers = []
+
+    async def broadcast(self, bot, chat_ids, text, progress=None, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS,
+                        on_progress=None, progress_interval=5, **kwargs):
+        """Send ``text`` to every chat in ``chat_ids`` (any iterable, consumed lazily).
+
+        Counts are kept on ``progress`` (a new BroadcastProgress if not
+        given); ``on_progress(progress)`` is awaited every
+        ``progress_interval`` seconds and once more at the end.
+        """
+        progress = progress or BroadcastProgress()
+        progress.started_at = monotonic()
+        bucket = TokenBucket(rate)
+        chat_ids = iter(chat_ids)
+
+        async def worker():
+            for chat_id in chat_ids:
+                await bucket.acquire()
+                status, _ = await self._deliver(bot, chat_id, text, **kwargs)
+                setattr(progress, status, getattr(progress, status) + 1)
+
+        async def report():
+            if on_progress is None:
+                return
+            try:
+                await on_progress(progress)
+            except Exception as e:
+                logger.warning(f"Broadcast progress callback failed: {e}")
+
+        async def reporter():
+            while True:
+                await asyncio.sleep(progress_interval)
+                await report()
+
+        reporter_task = asyncio.create_task(reporter())
+        try:
+            await asyncio.gather(*(worker() for _ in range(workers)))
+        finally:
+            reporter_task.cancel()
+            progress.finished_at = monotonic()
+        await report()
+
+        logger.info(f"Broadcast finished: {progress.sent} sent, {progress.blocked} blocked, {progress.failed} failed")
+        return progress
+
+
+notifier = FanOut()
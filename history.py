@@ -0,0 +1,129 @@
+import logging
+from datetime import datetime
+from database import fetchall
+from rendering import edit_message
+from telegram.helpers import escape_markdown
+from callbacks import Action, callback_data, router
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PAGE_SIZE = 10
+
+# Transaction kind = type up to the first underscore: deposit_USDT -> deposit,
+# daily_bonus -> daily, withdrawal_request_TON -> withdrawal. The
+# idx_transactions_user_kind expression index is built on exactly this
+# expression, so filtered pages are an ordered range scan of one user's
+# rows of one kind.
+KIND_EXPR = "substr(type, 1, instr(type || '_', '_') - 1)"
+
+# Filter key -> (button label, kind or None for everything)
+HISTORY_FILTERS = {
+    "all": ("All", None),
+    "dep": ("Deposits", "deposit"),
+    "bon": ("Bonuses", "daily"),
+    "wd": ("Withdrawals", "withdrawal"),
+}
+
+TYPE_LABELS = {
+    "deposit": "💰 Deposit",
+    "daily_bonus": "🎁 Daily bonus",
+    "referral_bonus": "👥 Referral bonus",
+    "withdrawal_request": "💸 Withdrawal",
+    "withdrawal_refund": "↩️ Withdrawal refund",
+}
+
+
+def get_transactions(user_id, kind=None, before=None, after=None, limit=HISTORY_PAGE_SIZE):
+    """One page of a user's transactions, newest first.
+
+    Keyset pagination on (user_id, id): pass the last id of the current
+    page as ``before`` for older rows, or the first as ``after`` for newer
+    ones. Returns (rows, has_newer, has_older).
+    """
+    where = "user_id = ?"
+    params = [user_id]
+    if kind is not None:
+        where += f" AND {KIND_EXPR} = ?"
+        params.append(kind)
+
+    if after is not None:
+        rows = fetchall(
+            f"SELECT id, amount, type, timestamp FROM transactions "
+            f"WHERE {where} AND id > ? ORDER BY id LIMIT ?",
+            (*params, after, limit + 1)
+        )
+        has_newer = len(rows) > limit
+        return rows[:limit][::-1], has_newer, True
+
+    rows = fetchall(
+        f"SELECT id, amount, type, timestamp FROM transactions "
+        f"WHERE {where} AND id < ? ORDER BY id DESC LIMIT ?",
+        (*params, before if before is not None else 2 ** 63 - 1, limit + 1)
+    )
+    return rows[:limit], before is not None, len(rows) > limit
+
+
+def _describe(transaction_type):
+    if transaction_type in TYPE_LABELS:
+        return TYPE_LABELS[transaction_type]
+    # Per-asset types, e.g. deposit_USDT / withdrawal_request_USDT
+    prefix, _, asset = transaction_type.rpartition("_")
+    if prefix in TYPE_LABELS:
+        return f"{TYPE_LABELS[prefix]} {asset}"
+    return transaction_type
+
+
+async def handle_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Display the user's transaction history, one page at a time.
+
+    callback args: ``<filter>`` for the newest page, then ``<filter> b <id>``
+    (older than id) or ``<filter> a <id>`` (newer than id).
+    """
+    query = update.callback_query
+    await query.answer()
+
+    user_id = query.from_user.id
+    args = context.args or []
+    filter_key = args[0] if args and args[0] in HISTORY_FILTERS else "all"
+    direction, cursor = args[1:3] if len(args) == 3 else (None, None)
+    kind = HISTORY_FILTERS[filter_key][1]
+
+    rows, has_newer, has_older = get_transactions(
+        user_id,
+        kind=kind,
+        before=int(cursor) if direction == "b" else None,
+        after=int(cursor) if direction == "a" else None
+    )
+
+    if rows:
+        lines = ["📜 *Transaction History*\n"]
+        for _, amount, transaction_type, timestamp in rows:
+            when = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").strftime("%d %b %Y %H:%M") if timestamp else ""
+            lines.append(f"{when} · {escape_markdown(_describe(transaction_type))} · {'+' if amount >= 0 else '-'}${abs(amount):.2f}")
+        message = "\n".join(lines)
+    else:
+        message = "📜 *Transaction History*\n\nNo transactions yet."
+
+    keyboard = [[
+        InlineKeyboardButton(
+            f"• {label}" if key == filter_key else label,
+            callback_data=callback_data(Action.HISTORY, key)
+        )
+        for key, (label, _) in HISTORY_FILTERS.items()
+    ]]
+    page_nav = []
+    if has_newer and rows:
+        page_nav.append(InlineKeyboardButton("⬅️ Newer", callback_data=callback_data(Action.HISTORY, filter_key, "a", rows[0][0])))
+    if has_older and rows:
+        page_nav.append(InlineKeyboardButton("Older ➡️", callback_data=callback_data(Action.HISTORY, filter_key, "b", rows[-1][0])))
+    if page_nav:
+        keyboard.append(page_nav)
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data=callback_data(Action.MAIN_MENU))])
+
+    await edit_message(query, message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+
+
+def add_history_handlers(application):
+    router.add(Action.HISTORY, handle_history)
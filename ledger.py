@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from decimal import Decimal, ROUND_HALF_UP
+from database import transaction, fetchone, read_connection
+
+logger = logging.getLogger(__name__)
+
+# Balances are kept in an append-only ledger of integer micro-USD. Each user
+# has two accounts: 'deposit' (drives the tier) and 'earning' (bonuses).
+# The ledger_apply trigger adds every new entry to the user's running
+# balance snapshot (users.deposit_micros / users.earning_micros), so a
+# balance change is a single INSERT and a balance read is one row.
+#
+# Never UPDATE users.*_micros directly; post an entry instead.
+DEPOSIT = "deposit"
+EARNING = "earning"
+MINOR_UNITS = 1_000_000   # micro-USD: exact for 3-decimal bonuses and % shares
+
+# Entries older than this are folded into ledger_checkpoints
+LEDGER_RETENTION_DAYS = 90
+CHECKPOINT_INTERVAL = 24 * 3600
+CHECKPOINT_BATCH_SIZE = 50000   # entries folded per write transaction
+
+
+def to_minor(amount):
+    """USD amount -> integer micro-USD (half-up)."""
+    return int((Decimal(str(amount)) * MINOR_UNITS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(amount):
+    return amount / MINOR_UNITS
+
+
+def post(conn, user_id, account, amount, entry_type):
+    """Append one entry of ``amount`` USD (negative for debits)."""
+    conn.execute(
+        "INSERT INTO ledger (user_id, account, amount, type, created_at) VALUES (?, ?, ?, ?, datetime('now'))",
+        (user_id, account, to_minor(amount), entry_type)
+    )
+
+
+def post_many(conn, entries):
+    """Append (user_id, account, amount, entry_type) entries with one executemany."""
+    conn.executemany(
+        "INSERT INTO ledger (user_id, account, amount, type, created_at) VALUES (?, ?, ?, ?, datetime('now'))",
+        [(user_id, account, to_minor(amount), entry_type) for user_id, account, amount, entry_type in entries]
+    )
+
+
+def get_balances(conn, user_id):
+    """(deposit, earning) in USD from the user's snapshot, or None if unknown."""
+    row = conn.execute("SELECT deposit_micros, earning_micros FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    return (from_minor(row[0]), from_minor(row[1])) if row else None
+
+
+def create_ledger_schema(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        account TEXT NOT NULL CHECK (account IN ('deposit', 'earning')),
+        amount INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ledger_checkpoints (
+        user_id INTEGER NOT NULL,
+        account TEXT NOT NULL,
+        balance INTEGER NOT NULL,
+        through_id INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, account)
+    )
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS ledger_apply AFTER INSERT ON ledger BEGIN
+        UPDATE users SET
+            deposit_micros = deposit_micros + (CASE WHEN NEW.account = 'deposit' THEN NEW.amount ELSE 0 END),
+            earning_micros = earning_micros + (CASE WHEN NEW.account = 'earning' THEN NEW.amount ELSE 0 END)
+        WHERE user_id = NEW.user_id;
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS ledger_append_only BEFORE UPDATE ON ledger BEGIN
+        SELECT RAISE(ABORT, 'ledger entries cannot be changed');
+    END
+    ''')
+
+
+def checkpoint_ledger(retention_days=LEDGER_RETENTION_DAYS, batch_size=CHECKPOINT_BATCH_SIZE):
+    """Fold entries older than ``retention_days`` into per-account checkpoints.
+
+    The snapshots are untouched; the ledger just stops growing without
+    bound. Works through entry id ranges of ``batch_size``, one short write
+    transaction each, like users.retier_users. Returns the number of
+    entries folded.
+    """
+    first_id, through_id = fetchone(
+        "SELECT MIN(id), (SELECT MAX(id) FROM ledger WHERE created_at < datetime('now', ?)) FROM ledger",
+        (f"-{retention_days} days",)
+    )
+    if through_id is None:
+        return 0
+
+    folded = 0
+    low = first_id
+    while low <= through_id:
+        high = min(low + batch_size - 1, through_id)
+        with transaction(immediate=True) as conn:
+            conn.execute('''
+            INSERT INTO ledger_checkpoints (user_id, account, balance, through_id, created_at)
+            SELECT user_id, account, SUM(amount), ?, datetime('now') FROM ledger
+            WHERE id BETWEEN ? AND ? GROUP BY user_id, account
+            ON CONFLICT(user_id, account) DO UPDATE SET
+                balance = balance + excluded.balance,
+                through_id = excluded.through_id,
+                created_at = excluded.created_at
+            ''', (high, low, high))
+            folded += conn.execute("DELETE FROM ledger WHERE id BETWEEN ? AND ?", (low, high)).rowcount
+        low = high + 1
+
+    logger.info(f"Folded {folded} ledger entries into checkpoints (through entry {through_id})")
+    return folded
+
+
+def find_balance_mismatches():
+    """Users whose snapshot differs from checkpoints + ledger entries.
+
+    A full scan, so it reads from its own WAL snapshot outside the pool.
+    """
+    with read_connection() as conn:
+        return conn.execute('''
+        SELECT u.user_id, u.deposit_micros, u.earning_micros, COALESCE(t.deposit, 0), COALESCE(t.earning, 0)
+        FROM users u LEFT JOIN (
+            SELECT user_id,
+                SUM(CASE WHEN account = 'deposit' THEN amount ELSE 0 END) AS deposit,
+                SUM(CASE WHEN account = 'earning' THEN amount ELSE 0 END) AS earning
+            FROM (
+                SELECT user_id, account, amount FROM ledger
+                UNION ALL
+                SELECT user_id, account, balance FROM ledger_checkpoints
+            )
+            GROUP BY user_id
+        ) t ON t.user_id = u.user_id
+        WHERE u.deposit_micros != COALESCE(t.deposit, 0) OR u.earning_micros != COALESCE(t.earning, 0)
+        ''').fetchall()
+
+
+async def checkpoint_job(context):
+    # Both scan the whole ledger: keep them off the event loop
+    await asyncio.to_thread(checkpoint_ledger)
+    mismatches = await asyncio.to_thread(find_balance_mismatches)
+    if mismatches:
+        logger.error(f"{len(mismatches)} balance snapshots disagree with the ledger, e.g. {mismatches[:5]}")
+
+
+def add_ledger_jobs(application):
+    application.job_queue.run_repeating(checkpoint_job, interval=CHECKPOINT_INTERVAL, first=600, name="checkpoint_ledger")
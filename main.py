@@ -1,11 +1,31 @@
+import time
+STARTUP_BEGAN = time.perf_counter()   # taken before the imports below so they are timed too
+
+import asyncio
 import logging
-import sqlite3
 import os
+import signal
 from datetime import datetime
-from daily_bonus import add_daily_bonus_handlers ,check_daily_bonus,claim_daily_bonus
-from payment_method import add_payment_handlers, handle_payment_message, deposit_handler, withdraw_handler
+from daily_bonus import add_daily_bonus_handlers
+from payment_method import add_payment_handlers, handle_payment_message, test_api_connection, close_api_clients
 from admin import add_admin_handlers
+from history import add_history_handlers
+from payouts import add_payout_worker
+from database import transaction, fetchall, close_pool
+from migrations import setup_schema
+from persistence import SQLitePersistence
+from scheduler import KeyedUpdateProcessor
+from referrals import record_new_referral
+from ledger import add_ledger_jobs
+from user_cache import invalidate_user
+from config import TIERS
+from users import get_user_info
+from callbacks import Action, callback_data, router
+from rendering import MAIN_MENU_MARKUP, ACCOUNT_MENU_MARKUP, Verbatim, render_markdown, edit_message
+from webhook_server import start_webhook_server
+from fanout import notifier
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     ApplicationBuilder, 
     ContextTypes, 
@@ -30,134 +50,55 @@ APP_NAME = os.getenv("APP_NAME")
 PORT = int(os.environ.get("PORT", 8080))
 WEBHOOK_PATH = f"/{BOT_TOKEN}"
 WEBHOOK_URL = f"https://{APP_NAME}.onrender.com{WEBHOOK_PATH}"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # optional X-Telegram-Bot-Api-Secret-Token
+# Set https://<APP_NAME>.onrender.com/cryptopay-webhook as the webhook URL in @CryptoBot
+CRYPTOPAY_WEBHOOK_PATH = "/cryptopay-webhook"
 
-# Tier configuration
-TIERS = {
-    'Bronze': {'min_deposit': 0, 'referral_bonus': 5},       # 5% referral bonus
-    'Silver': {'min_deposit': 50, 'referral_bonus': 15},    # 15% referral bonus
-    'Gold': {'min_deposit': 150, 'referral_bonus': 25}, # 25% referral bonus
-    'Diamond': {'min_deposit':500, 'referral_bonus':40}   # 40% referral bonus           
-}
-
-# Database setup
-def setup_database():
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    
-    # Create users table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        username TEXT,
-        referrer_id INTEGER,
-        deposit_amount REAL DEFAULT 0.0,
-        earning_amount REAL DEFAULT 0.0,
-        tier TEXT DEFAULT 'Bronze',
-        join_date TEXT,
-        FOREIGN KEY (referrer_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    # Create transactions table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS transactions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        amount REAL,
-        type TEXT,
-        timestamp TEXT,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-# Helper functions
-def get_user_tier(deposit_amount):
-    """Determine user tier based on deposit amount."""
-    if deposit_amount >= TIERS['Diamond']['min_deposit']:
-        return 'Diamond'
-    elif deposit_amount >= TIERS['Gold']['min_deposit']:
-        return 'Gold'
-    elif deposit_amount >= TIERS['Silver']['min_deposit']:
-        return 'Silver'
-    else:
-        return 'Bronze'
-
-def update_user_tier(user_id, deposit_amount,conn=None, cursor=None):
-    """Update user tier based on new deposit amount."""
-    close_conn = False
-    if conn is None or cursor is None:
-        conn = sqlite3.connect("referral_bot.db", check_same_thread=False, timeout=10)
-        cursor = conn.cursor()
-        close_conn = True
-    
-    new_tier = get_user_tier(deposit_amount)
-    
-    cursor.execute(
-        "UPDATE users SET deposit_amount = ?, tier = ? WHERE user_id = ?", 
-        (deposit_amount, new_tier, user_id)
-    )
-    
-    if close_conn:
-        conn.commit()
-        conn.close()
-    
-    return new_tier
-
-def add_transaction(user_id, amount, transaction_type,conn=None, cursor=None):
-    """Record a transaction."""
-    close_conn = False
-    if conn is None or cursor is None:
-        conn = sqlite3.connect("referral_bot.db", check_same_thread=False, timeout=10)
-        cursor = conn.cursor()
-        close_conn = True
-    
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+REFERRALS_PAGE_SIZE = 10
+
+# Seconds between writes of changed context.user_data to the database
+PERSISTENCE_INTERVAL = int(os.getenv("PERSISTENCE_INTERVAL", 30))
+
+# Static texts rendered once from TIERS
+TIER_BENEFITS_TEXT = "*Tier Benefits:*\n" + "\n".join(
+    f"• {name} (${tier['min_deposit']}+): {tier['referral_bonus']}% referral bonus"
+    for name, tier in TIERS.items()
+)
+
+ACCOUNT_TEMPLATE = (
+    "📊 *Account Information*\n\n"
+    "User ID: `{user_id}`\n"
+    "Username: {username}\n"
+    "Current Tier: {tier}\n"
+    "Total Deposits: ${deposit_amount:.2f}\n"
+    "Total Earnings: ${earning_amount:.2f}\n"
+    "Available Balance: ${balance:.2f}\n"
+    "Join Date: {join_date}\n\n"
+    "Your Referral Link:\n`{referral_link}`\n\n"
+) + TIER_BENEFITS_TEXT.replace("{", "{{").replace("}", "}}")
+
+def get_referrals(user_id, after=None, before=None, limit=REFERRALS_PAGE_SIZE):
+    """Get one page of users referred by this user, ordered by user_id.
+
+    Keyset pagination on (referrer_id, user_id): pass the last user_id of the
+    current page as ``after`` for the next page, or the first as ``before``
+    for the previous one. Returns (rows, has_prev, has_next).
+    """
+    if before is not None:
+        rows = fetchall(
+            "SELECT user_id, username, tier, deposit_micros / 1e6 FROM users "
+            "WHERE referrer_id = ? AND user_id < ? ORDER BY user_id DESC LIMIT ?",
+            (user_id, before, limit + 1)
+        )
+        has_prev = len(rows) > limit
+        return rows[:limit][::-1], has_prev, True
     
-    cursor.execute(
-        "INSERT INTO transactions (user_id, amount, type, timestamp) VALUES (?, ?, ?, ?)",
-        (user_id, amount, transaction_type, timestamp)
+    rows = fetchall(
+        "SELECT user_id, username, tier, deposit_micros / 1e6 FROM users "
+        "WHERE referrer_id = ? AND user_id > ? ORDER BY user_id LIMIT ?",
+        (user_id, after if after is not None else -1, limit + 1)
     )
-    
-    if close_conn:
-        conn.commit()
-        conn.close()
-
-def get_user_info(user_id):
-    """Get user information from database."""
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-    user = cursor.fetchone()
-    
-    
-    conn.close()
-    
-    if user:
-        return {
-            'user_id': user[0],
-            'username': user[1],
-            'referrer_id': user[2],
-            'deposit_amount': user[3],
-            'earning_amount': user[4],
-            'tier': user[5],
-            'join_date': user[6]
-        }
-    return None
-
-def get_referrals(user_id):
-    """Get users referred by this user."""
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT user_id, username, tier, deposit_amount FROM users WHERE referrer_id = ?", (user_id,))
-    referrals = cursor.fetchall()
-    
-    conn.close()
-    return referrals
+    return rows[:limit], after is not None, len(rows) > limit
 
 # 5 Helper funtion to stramline the bot workiing and database flow.
 
@@ -167,64 +108,52 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     username = update.effective_user.username or update.effective_user.first_name
     
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    
-    # Check if user already exists
-    cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-    existing_user = cursor.fetchone()
-    
-    # Handle referral link
-    referrer_id = None
-    if len(context.args) > 0:
-        try:
-            referrer_id = int(context.args[0])
-            # Verify referrer exists
-            cursor.execute("SELECT * FROM users WHERE user_id = ?", (referrer_id,))
-            if not cursor.fetchone():
+    with transaction(immediate=True) as conn:
+        # Check if user already exists
+        existing_user = conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        
+        # Handle referral link
+        referrer_id = None
+        if len(context.args) > 0:
+            try:
+                referrer_id = int(context.args[0])
+                # Verify referrer exists
+                if not conn.execute("SELECT 1 FROM users WHERE user_id = ?", (referrer_id,)).fetchone():
+                    referrer_id = None
+            except ValueError:
                 referrer_id = None
-        except ValueError:
-            referrer_id = None
+        
+        if not existing_user:
+            # Register new user
+            join_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            conn.execute(
+                "INSERT INTO users (user_id, username, referrer_id, join_date) VALUES (?, ?, ?, ?)",
+                (user_id, username, referrer_id, join_date)
+            )
+            if referrer_id:
+                record_new_referral(conn, referrer_id)
+    
+    if not existing_user:
+        invalidate_user(user_id, referrer_id)
     
     if not existing_user:
-        # Register new user
-        join_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute(
-            "INSERT INTO users (user_id, username, referrer_id, join_date) VALUES (?, ?, ?, ?)",
-            (user_id, username, referrer_id, join_date)
-        )
-        
         welcome_message = "🎉 Welcome to the DRRS --> Daily Reward & Referral Bot! 🎉\n\n"
         
         if referrer_id:
             welcome_message += "You were referred by a friend! You'll both earn bonuses when you make deposits.\n\n"
-        
-        conn.commit()
     else:
         welcome_message = "Welcome back to the DRRS --> Daily Reward & Referral Bot!\n\n"
     
-    conn.close()
-    
     # Create referral link
     referral_link = f"https://t.me/{context.bot.username}?start={user_id}"
     
-    # Prepare inline keyboard
-    keyboard = [
-        [InlineKeyboardButton("💰 Make Deposit", callback_data="deposit"),
-        InlineKeyboardButton("🎁 Daily Bonus", callback_data="daily_bonus")],
-        [InlineKeyboardButton("💸 Withdraw", callback_data="withdraw"),
-        InlineKeyboardButton("👥 My Referrals", callback_data="referrals")],
-        [InlineKeyboardButton("📊 My Account", callback_data="account")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     welcome_message += (
             f"• Use the buttons below to navigate\n\n"
             f"• Earn higher bonuses by upgrading your tier!\n\n"
         )
     welcome_message += f"• Share your referral link:\n `{referral_link}`"
     
-    await update.message.reply_text(welcome_message, reply_markup=reply_markup, parse_mode="Markdown")
+    await update.message.reply_text(welcome_message, reply_markup=MAIN_MENU_MARKUP, parse_mode="Markdown")
 
 async def handle_account(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Display user account information. (My Account Button)"""
@@ -235,55 +164,55 @@ async def handle_account(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_info = get_user_info(user_id)
     
     if not user_info:
-        await query.edit_message_text("User not found. Please restart the bot with /start")
+        await edit_message(query, "User not found. Please restart the bot with /start")
         return
     
     referral_link = f"https://t.me/{context.bot.username}?start={user_id}"
     
-    account_info = (
-        f"📊 *Account Information*\n\n"
-        f"User ID: `{user_id}`\n"
-        f"Username: {user_info['username']}\n"
-        f"Current Tier: {user_info['tier']}\n"
-        f"Total Deposits: ${user_info['deposit_amount']:.2f}\n"
-        f"Total Earnings: ${user_info['earning_amount']:.2f}\n"
-        f"Available Balance: ${user_info['earning_amount'] + user_info['deposit_amount']:.2f}\n"
-        f"Join Date: {user_info['join_date']}\n\n"
-        f"Your Referral Link:\n`{referral_link}`\n\n"
-        f"*Tier Benefits:*\n"
-        f"• Bronze (${TIERS['Bronze']['min_deposit']}+): {TIERS['Bronze']['referral_bonus']}% referral bonus\n"
-        f"• Silver (${TIERS['Silver']['min_deposit']}+): {TIERS['Silver']['referral_bonus']}% referral bonus\n"
-        f"• Gold (${TIERS['Gold']['min_deposit']}+): {TIERS['Gold']['referral_bonus']}% referral bonus\n"
-        f"• Diamond (${TIERS['Diamond']['min_deposit']}+): {TIERS['Diamond']['referral_bonus']}% referral bonus"
+    account_info = render_markdown(
+        ACCOUNT_TEMPLATE,
+        user_id=user_id,
+        username=str(user_info['username']),
+        tier=user_info['tier'],
+        deposit_amount=user_info['deposit_amount'],
+        earning_amount=user_info['earning_amount'],
+        balance=user_info['earning_amount'] + user_info['deposit_amount'],
+        join_date=user_info['join_date'],
+        referral_link=Verbatim(referral_link)
     )
     
-    keyboard = [
-        [InlineKeyboardButton("💰 Make Deposit", callback_data="deposit"),
-        InlineKeyboardButton("🎁 Daily Bonus", callback_data="daily_bonus")],
-        [InlineKeyboardButton("💸 Withdraw", callback_data="withdraw"),
-        InlineKeyboardButton("👥 My Referrals", callback_data="referrals")],
-        [InlineKeyboardButton("🔙 Back", callback_data="back_to_main")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(account_info, reply_markup=reply_markup, parse_mode="Markdown")
+    await edit_message(query, account_info, reply_markup=ACCOUNT_MENU_MARKUP, parse_mode="Markdown")
 
 async def handle_referrals(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Display user's referrals."""
+    """Display user's referrals, one page at a time.
+
+    The first page has no callback arguments; the next/previous pages carry
+    ``a <id>`` or ``b <id>`` (after/before the given referral).
+    """
     query = update.callback_query
     await query.answer()
     
     user_id = query.from_user.id
-    referrals = get_referrals(user_id)
+    user_info = get_user_info(user_id)
+    
+    direction, cursor = context.args if len(context.args) == 2 else (None, None)
+    after = int(cursor) if direction == "a" else None
+    before = int(cursor) if direction == "b" else None
+    referrals, has_prev, has_next = get_referrals(user_id, after=after, before=before)
+    
+    referral_count = user_info['referral_count'] if user_info else 0
     
     if not referrals:
         referral_message = "You haven't referred any users yet. Share your referral link to start earning bonuses!"
     else:
-        referral_message = "👥 *Your Referrals:*\n\n"
-        for i, (ref_id, username, tier, amount) in enumerate(referrals, 1):
-            referral_message += f"{i}. {username} - Tier: {tier} - Deposits: ${amount:.2f}\n"
+        referral_message = (
+            f"👥 *Your Referrals:* {referral_count} total, "
+            f"{user_info['depositing_referral_count']} with deposits\n\n"
+        )
+        for ref_id, username, tier, amount in referrals:
+            name = escape_markdown(str(username or ref_id))
+            referral_message += f"• {name} - Tier: {tier} - Deposits: ${amount:.2f}\n"
     
-    user_info = get_user_info(user_id)
     tier = user_info['tier'] if user_info else 'Bronze'
     bonus_rate = TIERS[tier]['referral_bonus']
     
@@ -293,54 +222,39 @@ async def handle_referrals(update: Update, context: ContextTypes.DEFAULT_TYPE):
     referral_link = f"https://t.me/{context.bot.username}?start={user_id}"
     referral_message += f"\n\nYour Referral Link:\n`{referral_link}`"
     
-    keyboard = [
-        [InlineKeyboardButton("💰 Make Deposit", callback_data="deposit")],
-        [InlineKeyboardButton("📊 My Account", callback_data="account")],
-        [InlineKeyboardButton("🔙 Back", callback_data="back_to_main")]
+    keyboard = []
+    page_nav = []
+    if has_prev and referrals:
+        page_nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=callback_data(Action.REFERRALS, "b", referrals[0][0])))
+    if has_next and referrals:
+        page_nav.append(InlineKeyboardButton("Next ➡️", callback_data=callback_data(Action.REFERRALS, "a", referrals[-1][0])))
+    if page_nav:
+        keyboard.append(page_nav)
+    keyboard += [
+        [InlineKeyboardButton("💰 Make Deposit", callback_data=callback_data(Action.DEPOSIT))],
+        [InlineKeyboardButton("📊 My Account", callback_data=callback_data(Action.ACCOUNT))],
+        [InlineKeyboardButton("🔙 Back", callback_data=callback_data(Action.MAIN_MENU))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(referral_message, reply_markup=reply_markup, parse_mode="Markdown")
+    await edit_message(query, referral_message, reply_markup=reply_markup, parse_mode="Markdown")
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle user messages for deposits or withdrawals."""
     await handle_payment_message(update, context)
     
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle button callbacks."""
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Return to the main menu."""
     query = update.callback_query
+    await query.answer()
     
-    if query.data == "deposit":
-        await deposit_handler(update, context)
-    elif query.data == "withdraw":
-        await withdraw_handler(update, context)
-    elif query.data == "referrals":
-        await handle_referrals(update, context)
-    elif query.data == "account":
-        await handle_account(update, context)
-    elif query.data == "daily_bonus":
-        await check_daily_bonus(update, context)
-    elif query.data == "claim_bonus":
-        await claim_daily_bonus(update, context)
-    elif query.data == "back_to_main":
-        # Return to main menu
-        user_id = query.from_user.id
+    user_id = query.from_user.id
+    referral_link = f"https://t.me/{context.bot.username}?start={user_id}"
     
-        referral_link = f"https://t.me/{context.bot.username}?start={user_id}"
-        
-        keyboard = [
-            [InlineKeyboardButton("💰 Make Deposit", callback_data="deposit"),
-            InlineKeyboardButton("🎁 Daily Bonus", callback_data="daily_bonus")],
-            [InlineKeyboardButton("💸 Withdraw", callback_data="withdraw"),
-            InlineKeyboardButton("👥 My Referrals", callback_data="referrals")],
-            [InlineKeyboardButton("📊 My Account", callback_data="account")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        welcome_message = f"Welcome to the Deposit & Referral Bot!\n\n• Use the buttons below to navigate\n• Share your referral link to earn bonuses: {referral_link}\n• Earn higher bonuses by upgrading your tier!"
-        
-        await query.edit_message_text(welcome_message, reply_markup=reply_markup)
+    welcome_message = f"Welcome to the Deposit & Referral Bot!\n\n• Use the buttons below to navigate\n• Share your referral link to earn bonuses: {referral_link}\n• Earn higher bonuses by upgrading your tier!"
+    
+    await edit_message(query, welcome_message, reply_markup=MAIN_MENU_MARKUP)
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Exception while handling an update: {context.error}")
@@ -351,31 +265,118 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
 
 
+class StartupTimer:
+    """Wall time of each startup phase, logged once the bot is serving."""
+
+    def __init__(self, began):
+        self.began = self.last = began
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        phases = ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.phases)
+        logger.info(f"Startup: {phases}; ready in {(self.last - self.began) * 1000:.0f}ms")
+
+
+async def check_external_apis():
+    started = time.perf_counter()
+    if not await test_api_connection():
+        logger.error("Failed to connect to Crypto Pay API. Payment system may not function correctly.")
+    logger.info(f"External API checks finished in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+
+async def on_startup(application):
+    """Run network probes in the background once the bot is serving."""
+    application.create_task(check_external_apis())
+
+
+async def on_shutdown(application):
+    """Release pooled database connections and HTTP clients."""
+    await close_api_clients()
+    close_pool()
+
+
 def main():
-    # Set up the database
-    setup_database()
+    timer = StartupTimer(STARTUP_BEGAN)
+    timer.mark("imports")
+
+    # Create tables and apply migrations (a no-op on an up-to-date database)
+    setup_schema()
+    timer.mark("schema")
     
     # Create the application
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    application = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .persistence(SQLitePersistence(update_interval=PERSISTENCE_INTERVAL))
+        # Different users' updates run in parallel; one user's run in order
+        .concurrent_updates(KeyedUpdateProcessor(admit=router.admit))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     add_daily_bonus_handlers(application)
     add_payment_handlers(application)
     add_admin_handlers(application)
+    add_history_handlers(application)
+    add_payout_worker(application)
+    add_ledger_jobs(application)
+    
     # Add handlers
     application.add_handler(CommandHandler("start", start))
     application.add_error_handler(error_handler)
-    application.add_handler(CallbackQueryHandler(button_handler))
+    router.add(Action.MAIN_MENU, show_main_menu)
+    router.add(Action.ACCOUNT, handle_account)
+    router.add(Action.REFERRALS, handle_referrals)
+    # Every button goes through the callback router
+    application.add_handler(CallbackQueryHandler(router.dispatch))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    timer.mark("handlers")
     
     # # Start the bot
     # logger.info("Starting bot...")
     # application.run_polling()
     # Run as webhook
     logger.info("Starting bot with webhook...")
-    application.run_webhook(
-        listen="0.0.0.0",
-        port=PORT,
-        webhook_path=WEBHOOK_PATH,
-        webhook_url=WEBHOOK_URL,
-    )
+    asyncio.run(run_webhook(application, timer))
+
+async def run_webhook(application, timer):
+    """Run the bot behind one HTTP server that serves both Telegram and Crypto Pay webhooks.
+
+    The server listens before anything talks to the network, so health
+    checks pass during a cold start; Telegram updates that arrive early
+    wait in the update queue.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    server = start_webhook_server(application, PORT, WEBHOOK_PATH, CRYPTOPAY_WEBHOOK_PATH, WEBHOOK_SECRET)
+    timer.mark("listen")
+    await application.initialize()
+    timer.mark("initialize")
+    await application.start()
+    timer.mark("start")
+    await application.bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+    timer.mark("set_webhook")
+    timer.report()
+    await application.post_init(application)
+    
+    try:
+        await stop_event.wait()
+    finally:
+        server.stop()
+        await application.stop()
+        # Deliver queued notifications while the bot can still send: after
+        # stop() no handler or job adds more, shutdown() closes the bot's HTTP client
+        await notifier.close()
+        await application.shutdown()
+        await application.post_shutdown(application)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,170 @@
+import logging
+import sqlite3
+from database import connection, transaction
+from referrals import backfill_referral_counts
+from ledger import create_ledger_schema, MINOR_UNITS
+from history import KIND_EXPR
+from stats import create_stats_schema, rebuild_stats
+from users import setup_database
+from daily_bonus import setup_daily_bonus_database
+from payment_method import setup_payment_database
+
+logger = logging.getLogger(__name__)
+
+# Schema migrations, applied in order. The database's PRAGMA user_version
+# records how many have run, so each one runs exactly once per database.
+# Append new migrations to the end of MIGRATIONS; never edit or reorder
+# one that has shipped.
+
+
+def _add_column(conn, table, column, definition):
+    """Add a column unless an older setup_* already created it."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def backfill_missing_columns(conn):
+    """Columns added to setup_* after the first databases were created."""
+    _add_column(conn, "daily_claims", "streak_days", "INTEGER DEFAULT 0")
+    _add_column(conn, "withdrawal_requests", "memo", "TEXT")
+
+
+def add_hot_query_indexes(conn):
+    """Indexes for the referral, admin queue, reconciler and history lookups."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_referrer ON users(referrer_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_withdrawals_status ON withdrawal_requests(status, request_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_status ON payment_invoices(status, invoice_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions(user_id, id)")
+
+
+def add_referral_counters(conn):
+    """Materialized referral counters on users, backfilled from existing rows."""
+    _add_column(conn, "users", "referral_count", "INTEGER DEFAULT 0")
+    _add_column(conn, "users", "depositing_referral_count", "INTEGER DEFAULT 0")
+    backfill_referral_counts(conn)
+
+
+def add_user_state_table(conn):
+    """Per-user conversation state written by SQLitePersistence."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS user_state (
+        user_id INTEGER PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at TEXT
+    )
+    ''')
+
+
+def add_withdrawal_usd_amount(conn):
+    """USD value deducted for each withdrawal (NULL for older requests)."""
+    _add_column(conn, "withdrawal_requests", "usd_amount", "REAL")
+
+
+def add_payout_columns(conn):
+    """Crypto Pay transfer bookkeeping for the payout worker."""
+    _add_column(conn, "withdrawal_requests", "spend_id", "TEXT")
+    _add_column(conn, "withdrawal_requests", "transfer_id", "INTEGER")
+    _add_column(conn, "withdrawal_requests", "payout_attempts", "INTEGER DEFAULT 0")
+    _add_column(conn, "withdrawal_requests", "payout_error", "TEXT")
+    _add_column(conn, "withdrawal_requests", "next_payout_at", "TEXT")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_withdrawals_spend_id ON withdrawal_requests(spend_id)")
+
+
+def move_balances_to_ledger(conn):
+    """Replace the REAL balance columns with the ledger and integer snapshots.
+
+    Each existing balance becomes an 'opening_balance' ledger entry, which
+    the ledger_apply trigger adds to the new snapshot columns.
+    """
+    _add_column(conn, "users", "deposit_micros", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "users", "earning_micros", "INTEGER NOT NULL DEFAULT 0")
+    create_ledger_schema(conn)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger(user_id, id)")
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+    for account, column in (("deposit", "deposit_amount"), ("earning", "earning_amount")):
+        if column not in columns:
+            continue
+        conn.execute(
+            f"INSERT INTO ledger (user_id, account, amount, type, created_at) "
+            f"SELECT user_id, ?, CAST(ROUND({column} * {MINOR_UNITS}) AS INTEGER), 'opening_balance', datetime('now') "
+            f"FROM users WHERE CAST(ROUND({column} * {MINOR_UNITS}) AS INTEGER) != 0",
+            (account,)
+        )
+        # DROP COLUMN needs SQLite 3.35; older versions just stop using it
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            conn.execute(f"ALTER TABLE users DROP COLUMN {column}")
+
+
+def add_transaction_kind_index(conn):
+    """Index for the history screen's type filters (see history.KIND_EXPR)."""
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_transactions_user_kind ON transactions(user_id, {KIND_EXPR}, id)")
+
+
+
+def add_stats_rollups(conn):
+    """Rollup tables and triggers for /stats, filled from existing rows."""
+    create_stats_schema(conn)
+    rebuild_stats(conn)
+
+
+MIGRATIONS = [
+    backfill_missing_columns,
+    add_hot_query_indexes,
+    add_referral_counters,
+    add_user_state_table,
+    add_withdrawal_usd_amount,
+    add_payout_columns,
+    move_balances_to_ledger,
+    add_transaction_kind_index,
+    add_stats_rollups,
+]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations():
+    """Bring the database up to the latest schema version.
+
+    Call after the setup_* functions have created the base tables.
+    """
+    with connection() as conn:
+        current = get_schema_version(conn)
+
+    if current >= len(MIGRATIONS):
+        return current
+
+    for version, migration in enumerate(MIGRATIONS[current:], start=current + 1):
+        with transaction(immediate=True) as conn:
+            # Re-check under the write lock in case another process migrated
+            if get_schema_version(conn) >= version:
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+        logger.info(f"Applied migration {version}: {migration.__name__}")
+
+    # Refresh planner statistics for the new indexes
+    with connection() as conn:
+        conn.execute("ANALYZE")
+
+    return len(MIGRATIONS)
+
+
+def setup_schema():
+    """Create the base tables and apply pending migrations, once per database.
+
+    A database already at the latest version skips every CREATE TABLE: the
+    whole check is a single PRAGMA read.
+    """
+    with connection() as conn:
+        if get_schema_version(conn) >= len(MIGRATIONS):
+            return False
+
+    setup_database()
+    setup_daily_bonus_database()
+    setup_payment_database()
+    run_migrations()
+    return True
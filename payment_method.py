@@ -1,29 +1,39 @@
 import logging
-import sqlite3
-import requests
-from time import time
+import hashlib
+import hmac
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+from database import transaction, fetchone, fetchall, execute
+from crypto_pay import CryptoPayClient, CoinMarketCapClient, CryptoPayError
+from exchange_rates import RateService
+from referrals import record_first_deposit, pay_referral_bonuses
+import ledger
+from user_cache import invalidate_user
+from users import get_user_info, update_user_tier, add_transaction
+from config import ADMIN_IDS
+from rendering import BACK_TO_MAIN_MARKUP, edit_message
+from callbacks import Action, callback_data, router
+from fanout import notifier
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import ContextTypes, CallbackQueryHandler
+from telegram.ext import ContextTypes
 
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 # Crypto Pay API Configuration
 CRYPTO_PAY_API_TOKEN = os.getenv("CRYPTOPAYAPI")  # Replace with your actual Crypto Pay API token
-CRYPTO_PAY_API_BASE = "https://testnet-pay.crypt.bot/api"
+CRYPTO_PAY_API_BASE = os.getenv("CRYPTO_PAY_API_BASE", "https://testnet-pay.crypt.bot/api")  # or a crypto_pay_standin.py URL
 COINMARKETCAP_API_KEY = os.getenv("COINCAPMARKETAPI")
 COINMARKETCAP_API_URL = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/latest"
 
-# Default headers for all API requests
-HEADERS = {
-    "Crypto-Pay-API-Token": CRYPTO_PAY_API_TOKEN
-}
-# Cache dictionary: { symbol: { 'price': ..., 'timestamp': ... } }
-EXCHANGE_RATE_CACHE = {}
-CACHE_TTL = 60  # cache live time in seconds
+# Shared async API clients (keep-alive connection pools)
+crypto_pay = CryptoPayClient(CRYPTO_PAY_API_TOKEN, CRYPTO_PAY_API_BASE)
+coinmarketcap = CoinMarketCapClient(COINMARKETCAP_API_KEY, COINMARKETCAP_API_URL)
+
+CACHE_TTL = 60  # exchange rate refresh interval in seconds
+RECONCILE_INTERVAL = 300  # seconds between active invoice sweeps
+INVOICE_BATCH_SIZE = 100  # invoice ids per getInvoices call
 
 # Supported assets and minimum deposit/withdrawal amounts
 SUPPORTED_ASSETS = {
@@ -36,259 +46,225 @@ SUPPORTED_ASSETS = {
 # Default asset
 DEFAULT_ASSET = "USDT"
 
+# Withdrawals are paid by Crypto Pay transfer to the requesting Telegram
+# user's own @CryptoBot wallet (see payouts.py), so no address is asked
+# for; this is what withdrawal_requests.wallet_address records instead.
+PAYOUT_DESTINATION = "@CryptoBot"
+
+# Exchange rates for every supported asset, refreshed in one request
+rate_service = RateService(coinmarketcap, SUPPORTED_ASSETS, ttl=CACHE_TTL)
+
+# Static screens, built once
+def _asset_selection_markup(action):
+    keyboard = [
+        [InlineKeyboardButton(f"{details['name']} ({asset})", callback_data=callback_data(action, asset))]
+        for asset, details in SUPPORTED_ASSETS.items()
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data=callback_data(Action.MAIN_MENU))])
+    return InlineKeyboardMarkup(keyboard)
+
+DEPOSIT_ASSETS_MARKUP = _asset_selection_markup(Action.DEPOSIT_ASSET)
+WITHDRAW_ASSETS_MARKUP = _asset_selection_markup(Action.WITHDRAW_ASSET)
+
+DEPOSIT_TEXT = (
+    "💰 *Deposit Funds*\n\n"
+    "Welcome to the deposit section!\n\n"
+    "• You can deposit in multiple cryptocurrencies (USDT, BTC, ETH, TON).\n"
+    "• *Minimum deposit*: \n"
+    "   - 20 USDT\n"
+    "   - 0.0005 BTC\n"
+    "   - 0.003 ETH\n"
+    "   - 50 TON\n\n"
+    "⚡️ *Tier System Benefits*:\n"
+    "Your total deposit amount determines your tier. Higher tiers give you better referral and bonus rewards:\n\n"
+    "🔹 *Tier 1* — $10+ deposited → Standard bonuses\n"
+    "🔸 *Tier 2* — $100+ deposited → +20% referral bonus\n"
+    "🏅 *Tier 3* — $500+ deposited → +50% referral bonus and priority rewards\n\n"
+    "🔐 Your funds are secure and can be withdrawn anytime after meeting the minimum balance and referral conditions.\n\n"
+    "👉 Please select a cryptocurrency to continue:"
+)
+
 
 # Database setup
 def setup_payment_database():
     """Set up database tables for payment system."""
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    
-    # Create payment_invoices table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS payment_invoices (
-        invoice_id TEXT PRIMARY KEY,
-        user_id INTEGER,
-        amount REAL,
-        asset TEXT,
-        status TEXT,
-        type TEXT,
-        created_at TEXT,
-        paid_at TEXT,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    # Create withdrawal_requests table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS withdrawal_requests (
-        request_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        amount REAL,
-        asset TEXT,
-        wallet_address TEXT,
-        status TEXT,
-        created_at TEXT,
-        processed_at TEXT,
-        memo TEXT,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        # Create payment_invoices table
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS payment_invoices (
+            invoice_id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            amount REAL,
+            asset TEXT,
+            status TEXT,
+            type TEXT,
+            created_at TEXT,
+            paid_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        ''')
+        
+        # Create withdrawal_requests table
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS withdrawal_requests (
+            request_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            asset TEXT,
+            wallet_address TEXT,
+            status TEXT,
+            created_at TEXT,
+            processed_at TEXT,
+            memo TEXT,
+            usd_amount REAL,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        ''')
     logger.info("Payment database tables created or verified")
 
-def fetch_real_time_usd_price(symbol):
+async def fetch_real_time_usd_price(symbol):
     """
-    Fetch the real-time USD price for a given crypto symbol using CoinMarketCap API with caching.
+    Get the USD price for a given crypto symbol from the background-refreshed rate cache.
     """
-    # Check cache first
-    current_time = time()
-    if symbol in EXCHANGE_RATE_CACHE:
-        cached = EXCHANGE_RATE_CACHE[symbol]
-        if current_time - cached['timestamp'] < CACHE_TTL:
-            return cached['price']
-
-    try:
-        headers = {
-            "Accepts": "application/json",
-            "X-CMC_PRO_API_KEY": COINMARKETCAP_API_KEY
-        }
-
-        params = {
-            "symbol": symbol,
-            "convert": "USD"
-        }
-
-        response = requests.get(COINMARKETCAP_API_URL, headers=headers, params=params, timeout=10)
-        data = response.json()
-
-        if response.status_code == 200 and "data" in data:
-            price = data["data"][symbol]["quote"]["USD"]["price"]
+    return await rate_service.get_price(symbol)
 
-            # Store in cache
-            EXCHANGE_RATE_CACHE[symbol] = {
-                "price": price,
-                "timestamp": current_time
-            }
-
-            return price
-        else:
-            logger.error(f"Error from CoinMarketCap API for {symbol}: {data}")
-            return EXCHANGE_RATE_CACHE.get(symbol, {}).get('price', None)  # fallback to old price
-    except Exception as e:
-        logger.error(f"Exception while fetching rate for {symbol}: {e}")
-        return EXCHANGE_RATE_CACHE.get(symbol, {}).get('price', None)  # fallback
-
-def convert_to_usd(amount, asset):
+async def convert_to_usd(amount, asset):
     """Convert crypto to USD using live exchange rate."""
-    price = fetch_real_time_usd_price(asset)
+    price = await fetch_real_time_usd_price(asset)
     if not price:
         logger.warning(f"Failed to fetch rate for {asset}, fallback to 1:1")
         return amount
     return amount * price
 
 # Convert USD to cryptocurrency
-def convert_from_usd(usd_amount, asset):
+async def convert_from_usd(usd_amount, asset):
     """Convert USD to crypto using live exchange rate."""
-    price = fetch_real_time_usd_price(asset)
+    price = await fetch_real_time_usd_price(asset)
     if not price or price == 0:
         logger.warning(f"Failed to fetch rate for {asset}, fallback to 1:1")
         return usd_amount
     return usd_amount / price
 
 # API Helper Functions
-def test_api_connection():
+async def test_api_connection():
     """Test connection to Crypto Pay API."""
     try:
-        response = requests.get(f"{CRYPTO_PAY_API_BASE}/getMe", headers=HEADERS)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("ok"):
-                logger.info(f"Connected to Crypto Pay API as: {data.get('result', {}).get('app_name')}")
-                return True
-        logger.error(f"Failed to connect to Crypto Pay API: {response.text}")
-        return False
-    except Exception as e:
-        logger.error(f"Error connecting to Crypto Pay API: {e}")
+        me = await crypto_pay.get_me()
+        logger.info(f"Connected to Crypto Pay API as: {me.get('app_name')}")
+        return True
+    except CryptoPayError as e:
+        logger.error(f"Failed to connect to Crypto Pay API: {e}")
         return False
 
-def get_supported_assets():
+async def get_supported_assets():
     """Get list of supported assets from Crypto Pay API."""
     try:
-        response = requests.get(f"{CRYPTO_PAY_API_BASE}/getAssets", headers=HEADERS)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("ok"):
-                assets = data.get("result", [])
-                return assets
-        return []
-    except Exception as e:
+        return await crypto_pay.get_assets() or []
+    except CryptoPayError as e:
         logger.error(f"Error fetching assets: {e}")
         return []
 
-def create_deposit_invoice(user_id, amount, asset=DEFAULT_ASSET):
+async def create_deposit_invoice(user_id, amount, asset=DEFAULT_ASSET):
     """Create a deposit invoice using Crypto Pay API."""
     try:
-        payload = {
-            "asset": asset,
-            "amount": str(amount),
-            "description": f"Deposit to bot account for user {user_id}",
-            "hidden_message": "Thank you for your deposit!",
-            "paid_btn_name": "openBot",
-            "paid_btn_url": f"https://t.me/Botlistsbot?start=deposit_success"
-        }
-        
-        response = requests.post(
-            f"{CRYPTO_PAY_API_BASE}/createInvoice", 
-            headers=HEADERS,
-            json=payload,
-            timeout=10
+        invoice = await crypto_pay.create_invoice(
+            asset=asset,
+            amount=str(amount),
+            description=f"Deposit to bot account for user {user_id}",
+            hidden_message="Thank you for your deposit!",
+            paid_btn_name="openBot",
+            paid_btn_url=f"https://t.me/Botlistsbot?start=deposit_success"
         )
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("ok"):
-                invoice = data.get("result")
-                
-                # Store invoice in database
-                conn = sqlite3.connect('referral_bot.db')
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO payment_invoices (invoice_id, user_id, amount, asset, status, type, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (
-                        invoice["invoice_id"], 
-                        user_id, 
-                        amount, 
-                        asset, 
-                        "active", 
-                        "deposit",
-                        datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    )
-                )
-                conn.commit()
-                conn.close()
-                
-                return invoice
-        
-        logger.error(f"Failed to create invoice: {response.text}")
+    except CryptoPayError as e:
+        logger.error(f"Failed to create invoice: {e}")
         return None
+    
+    try:
+        # Store invoice in database
+        execute(
+            "INSERT INTO payment_invoices (invoice_id, user_id, amount, asset, status, type, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                invoice["invoice_id"], 
+                user_id, 
+                amount, 
+                asset, 
+                "active", 
+                "deposit",
+                datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            )
+        )
+        
+        return invoice
     except Exception as e:
         logger.error(f"Error creating invoice: {e}")
         return None
 
-def get_invoice_status(invoice_id):
+async def get_invoice_status(invoice_id):
     """Get status of a specific invoice."""
     try:
-        params = {
-            "invoice_ids": invoice_id
-        }
-        
-        response = requests.get(
-            f"{CRYPTO_PAY_API_BASE}/getInvoices",
-            headers=HEADERS,
-            params=params,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("ok") and data.get("result", {}).get("items"):
-                return data["result"]["items"][0]
-        
-        return None
-    except Exception as e:
+        result = await crypto_pay.get_invoices(invoice_ids=str(invoice_id))
+        items = (result or {}).get("items")
+        return items[0] if items else None
+    except CryptoPayError as e:
         logger.error(f"Error checking invoice status: {e}")
         return None
 
-def process_successful_deposit(user_id, amount, asset=DEFAULT_ASSET):
-    """Process a successful deposit by updating user balance."""
+async def close_api_clients():
+    """Close the shared HTTP connection pools."""
+    await crypto_pay.close()
+    await coinmarketcap.close()
+
+def credit_deposit(conn, user_id, usd_amount, asset, invoice_id=None, pay_referrer=True):
+    """Credit a confirmed deposit inside the caller's transaction.
+
+    When ``invoice_id`` is given the invoice is marked paid as well, and an
+    invoice that is already paid is not credited again (returns None).
+    Pass ``pay_referrer=False`` when the caller settles referral bonuses for
+    a whole batch with pay_referral_bonuses.
+    """
+    if invoice_id is not None:
+        claimed = conn.execute(
+            "UPDATE payment_invoices SET status = 'paid', paid_at = ? WHERE invoice_id = ? AND status != 'paid'",
+            (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), str(invoice_id))
+        ).rowcount
+        if not claimed:
+            return None
+    
+    # Count the referrer's depositing referrals, then record the deposit
+    record_first_deposit(conn, user_id)
+    ledger.post(conn, user_id, ledger.DEPOSIT, usd_amount, f"deposit_{asset}")
+    add_transaction(user_id, usd_amount, f"deposit_{asset}", conn)
+    
+    # Re-tier on the new balance (read under the caller's write lock)
+    balances = ledger.get_balances(conn, user_id)
+    new_deposit = balances[0] if balances else usd_amount
+    new_tier = update_user_tier(user_id, new_deposit, conn)
+    
+    # Pay the referrer their tier's share
+    if pay_referrer:
+        pay_referral_bonuses(conn, [(user_id, usd_amount)])
+    
+    return {
+        "success": True,
+        "usd_amount": usd_amount,
+        "new_deposit": new_deposit,
+        "new_tier": new_tier
+    }
+
+async def process_successful_deposit(user_id, amount, asset=DEFAULT_ASSET, invoice_id=None):
+    """Process a successful deposit by updating user balance.
+
+    When ``invoice_id`` is given the invoice is marked paid in the same
+    transaction, and an invoice that is already paid is not credited again.
+    """
     try:
-        # Convert to USD equivalent (simplified - in reality, would use exchange rates)
-        # For now, assume 1:1 for USDT, and use spot prices for others
         # Convert to USD equivalent
-        usd_amount = convert_to_usd(amount, asset)
+        usd_amount = await convert_to_usd(amount, asset)
         
-        conn = sqlite3.connect("referral_bot.db", check_same_thread=False, timeout=10)
-        cursor = conn.cursor()
-
-        try:
+        with transaction(immediate=True) as conn:
+            result = credit_deposit(conn, user_id, usd_amount, asset, invoice_id)
         
-            # Get current deposit amount
-            cursor.execute("SELECT deposit_amount FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            current_deposit = result[0] if result else 0
-            
-            # Update deposit amount
-            new_deposit = current_deposit + usd_amount
-            cursor.execute(
-                "UPDATE users SET deposit_amount = ? WHERE user_id = ?",
-                (new_deposit, user_id)
-            )
-            
-            # Update user tier based on new deposit amount
-            from main import update_user_tier, add_transaction
-            new_tier = update_user_tier(user_id, new_deposit, conn, cursor)
-            
-            # Add transaction record
-            
-            add_transaction(user_id, usd_amount, f"deposit_{asset}",conn, cursor)
-            
-            conn.commit()
-            conn.close()
-            
-            return {
-                "success": True,
-                "usd_amount": usd_amount,
-                "new_deposit": new_deposit,
-                "new_tier": new_tier
-            }
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Error processing deposit: {e}")
-            return {"success": False, "error": str(e)}
-        finally:
-                conn.close()
+        return result or {"success": False, "already_processed": True}
     except Exception as e:
         logger.error(f"Error processing deposit: {e}")
         return {"success": False, "error": str(e)}
@@ -297,100 +273,182 @@ def process_successful_deposit(user_id, amount, asset=DEFAULT_ASSET):
 def create_withdrawal_request(user_id, amount, asset, wallet_address, usd_amount):
     """Create a withdrawal request to be processed by admin."""
     try:
-        conn = sqlite3.connect('referral_bot.db')
-        cursor = conn.cursor()
-        
-        try:
+        with transaction(immediate=True) as conn:
             now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
             # Insert withdrawal request
-            cursor.execute(
-                "INSERT INTO withdrawal_requests (user_id, amount, asset, wallet_address, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-                (user_id, amount, asset, wallet_address, "pending", now)
+            cursor = conn.execute(
+                "INSERT INTO withdrawal_requests (user_id, amount, asset, wallet_address, status, created_at, usd_amount) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, amount, asset, wallet_address, "pending", now, usd_amount)
             )
             
             request_id = cursor.lastrowid
             
-            # Update user balance - deduct from earnings first, then deposits if needed
-            cursor.execute("SELECT earning_amount, deposit_amount FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
+            # Deduct from earnings first, then deposits if needed
+            balances = ledger.get_balances(conn, user_id)
             
-            if not result:
+            if not balances:
                 raise ValueError("User not found")
                 
-            earning_amount, deposit_amount = result
+            deposit_amount, earning_amount = balances
+            from_earning = min(earning_amount, usd_amount)
+            from_deposit = usd_amount - from_earning
             
-            # Deduct from earnings first
-            if earning_amount >= usd_amount:
-                new_earning = earning_amount - usd_amount
-                new_deposit = deposit_amount
-            else:
-                # Deduct remainder from deposit
-                remainder = usd_amount - earning_amount
-                new_earning = 0
-                new_deposit = deposit_amount - remainder
-                
-                if new_deposit < 0:
-                    raise ValueError("Insufficient funds")
+            if from_deposit > deposit_amount:
+                raise ValueError("Insufficient funds")
             
-            cursor.execute(
-                "UPDATE users SET earning_amount = ?, deposit_amount = ? WHERE user_id = ?", 
-                (new_earning, new_deposit, user_id)
-            )
+            ledger.post_many(conn, [
+                (user_id, account, -amount_taken, f"withdrawal_request_{asset}")
+                for account, amount_taken in ((ledger.EARNING, from_earning), (ledger.DEPOSIT, from_deposit))
+                if amount_taken > 0
+            ])
+            new_earning = earning_amount - from_earning
+            new_deposit = deposit_amount - from_deposit
             
             # Add transaction record
-            from main import add_transaction
-            add_transaction(user_id, -usd_amount, f"withdrawal_request_{asset}", conn, cursor)
-            
-            conn.commit()
-            
-            return {
-                "success": True, 
-                "request_id": request_id,
-                "new_balance": new_earning + new_deposit
-            }
-            
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Database error creating withdrawal: {e}")
-            return {"success": False, "error": str(e)}
-        finally:
-            conn.close()
+            add_transaction(user_id, -usd_amount, f"withdrawal_request_{asset}", conn)
+        invalidate_user(user_id)
+        
+        return {
+            "success": True, 
+            "request_id": request_id,
+            "new_balance": new_earning + new_deposit
+        }
             
     except Exception as e:
         logger.error(f"Error creating withdrawal request: {e}")
         return {"success": False, "error": str(e)}
 
+def verify_webhook_signature(body, signature):
+    """Check the crypto-pay-api-signature header of a webhook request.
+
+    Crypto Pay signs the raw body with HMAC-SHA256 keyed by SHA256(api token).
+    """
+    if not signature or not CRYPTO_PAY_API_TOKEN:
+        return False
+    secret = hashlib.sha256(CRYPTO_PAY_API_TOKEN.encode()).digest()
+    expected = hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+async def handle_invoice_paid(bot, invoice):
+    """Credit a deposit pushed by the Crypto Pay ``invoice_paid`` webhook."""
+    invoice_id = str(invoice["invoice_id"])
+    invoice_record = fetchone(
+        "SELECT user_id, amount, asset, status FROM payment_invoices WHERE invoice_id = ?", (invoice_id,)
+    )
+    
+    if not invoice_record:
+        logger.warning(f"Webhook for unknown invoice {invoice_id}")
+        return
+    
+    user_id, amount, asset, status = invoice_record
+    if status == "paid":
+        return
+    
+    result = await process_successful_deposit(user_id, amount, asset, invoice_id=invoice_id)
+    
+    if result.get("already_processed"):
+        return
+    if not result["success"]:
+        # Let Crypto Pay retry the delivery
+        raise RuntimeError(f"Failed to credit invoice {invoice_id}: {result.get('error')}")
+    
+    await notify_deposit_confirmed(bot, user_id, amount, asset, result)
+
+async def notify_deposit_confirmed(bot, user_id, amount, asset, result):
+    """Tell a user their deposit was credited."""
+    await notifier.send(
+        bot,
+        user_id,
+        f"✅ Deposit confirmed: {amount} {asset} (${result['usd_amount']:.2f})\n\n"
+        f"Your deposit has been added to your account.\n\n"
+        f"Total deposit balance: ${result['new_deposit']:.2f}\n"
+        f"Current tier: {result['new_tier']}"
+    )
+
+async def reconcile_invoices(bot):
+    """Sync every active invoice with Crypto Pay in batches of INVOICE_BATCH_SIZE.
+
+    Each batch is one multi-id getInvoices call, and its paid/expired
+    transitions are applied in one DB transaction.
+    """
+    last_id = ""
+    paid_count = expired_count = 0
+    
+    while True:
+        rows = fetchall(
+            "SELECT invoice_id, user_id, amount, asset FROM payment_invoices "
+            "WHERE status = 'active' AND invoice_id > ? ORDER BY invoice_id LIMIT ?",
+            (last_id, INVOICE_BATCH_SIZE)
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        
+        try:
+            result = await crypto_pay.get_invoices(
+                invoice_ids=",".join(row[0] for row in rows),
+                count=len(rows)
+            )
+        except CryptoPayError as e:
+            logger.error(f"Invoice reconciliation stopped: {e}")
+            break
+        
+        api_status = {str(item["invoice_id"]): item["status"] for item in (result or {}).get("items", [])}
+        
+        # Convert before opening the transaction - rate lookups may await
+        paid = []
+        for invoice_id, user_id, amount, asset in rows:
+            if api_status.get(invoice_id) == "paid":
+                paid.append((invoice_id, user_id, amount, asset, await convert_to_usd(amount, asset)))
+        expired = [(row[0],) for row in rows if api_status.get(row[0]) == "expired"]
+        
+        if not paid and not expired:
+            continue
+        
+        credited = []
+        with transaction(immediate=True) as conn:
+            conn.executemany(
+                "UPDATE payment_invoices SET status = 'expired' WHERE invoice_id = ? AND status = 'active'",
+                expired
+            )
+            for invoice_id, user_id, amount, asset, usd_amount in paid:
+                deposit = credit_deposit(conn, user_id, usd_amount, asset, invoice_id, pay_referrer=False)
+                if deposit:
+                    credited.append((user_id, amount, asset, deposit))
+            pay_referral_bonuses(conn, [(user_id, deposit["usd_amount"]) for user_id, _, _, deposit in credited])
+        
+        paid_count += len(credited)
+        expired_count += len(expired)
+        for user_id, amount, asset, deposit in credited:
+            await notify_deposit_confirmed(bot, user_id, amount, asset, deposit)
+    
+    if paid_count or expired_count:
+        logger.info(f"Invoice reconciliation: {paid_count} paid, {expired_count} expired")
+
+async def reconcile_invoices_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback for reconcile_invoices."""
+    await reconcile_invoices(context.bot)
+
 async def notify_admins_of_withdrawal(update, context, ADMIN_IDS, user_id, request_id, amount, asset, wallet_address):
     """Notify admins of a new withdrawal request."""
-    from admin import ADMIN_IDS
-    
     message = (
         f"🔔 *New Withdrawal Request*\n\n"
         f"Request ID: `{request_id}`\n"
         f"User ID: `{user_id}`\n"
         f"Amount: `{amount} {asset}`\n"
-        f"Wallet: `{wallet_address}`\n\n"
+        f"Paid to: `{wallet_address}` wallet of the user\n\n"
         f"Use /admin to approve or reject."
     )
     
     keyboard = InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("✅ Approve", callback_data=f"approve_{request_id}"),
-            InlineKeyboardButton("❌ Reject", callback_data=f"reject_{request_id}")
+            InlineKeyboardButton("✅ Approve", callback_data=callback_data(Action.APPROVE_WITHDRAWAL, request_id)),
+            InlineKeyboardButton("❌ Reject", callback_data=callback_data(Action.REJECT_WITHDRAWAL, request_id))
         ]
     ])
     
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=message,
-                reply_markup=keyboard,
-                parse_mode="Markdown"
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify admin {admin_id}: {e}")
+    await notifier.send_many(context.bot, ADMIN_IDS, message, reply_markup=keyboard, parse_mode="Markdown")
 
 
 # Telegram Bot Handlers
@@ -403,40 +461,15 @@ async def deposit_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['previous_state'] = 'deposit'
     
     # Show asset selection
-    keyboard = []
-    for asset, details in SUPPORTED_ASSETS.items():
-        keyboard.append([InlineKeyboardButton(f"{details['name']} ({asset})", callback_data=f"deposit_asset_{asset}")])
-    
-    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="back_to_main")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(
-        "💰 *Deposit Funds*\n\n"
-        "Welcome to the deposit section!\n\n"
-        "• You can deposit in multiple cryptocurrencies (USDT, BTC, ETH, TON).\n"
-        "• *Minimum deposit*: \n"
-        "   - 20 USDT\n"
-        "   - 0.0005 BTC\n"
-        "   - 0.003 ETH\n"
-        "   - 50 TON\n\n"
-        "⚡️ *Tier System Benefits*:\n"
-        "Your total deposit amount determines your tier. Higher tiers give you better referral and bonus rewards:\n\n"
-        "🔹 *Tier 1* — $10+ deposited → Standard bonuses\n"
-        "🔸 *Tier 2* — $100+ deposited → +20% referral bonus\n"
-        "🏅 *Tier 3* — $500+ deposited → +50% referral bonus and priority rewards\n\n"
-        "🔐 Your funds are secure and can be withdrawn anytime after meeting the minimum balance and referral conditions.\n\n"
-        "👉 Please select a cryptocurrency to continue:",
-        reply_markup=reply_markup,
-        parse_mode="Markdown"
-    )
+    await edit_message(query, DEPOSIT_TEXT, reply_markup=DEPOSIT_ASSETS_MARKUP, parse_mode="Markdown")
 
 async def deposit_asset_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle asset selection for deposit."""
     query = update.callback_query
     await query.answer()
     
-    # Extract selected asset from callback data
-    asset = query.data.split('_')[2]
+    # Selected asset from callback data
+    asset = context.args[0]
     
     # Store selected asset in user data
     context.user_data['selected_asset'] = asset
@@ -450,10 +483,10 @@ async def deposit_asset_selected(update: Update, context: ContextTypes.DEFAULT_T
         f"Example: To deposit {min_amount} {asset}, just type `{min_amount}`"
     )
     
-    keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="deposit")]]
+    keyboard = [[InlineKeyboardButton("🔙 Back", callback_data=callback_data(Action.DEPOSIT))]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(deposit_message, reply_markup=reply_markup, parse_mode="Markdown")
+    await edit_message(query, deposit_message, reply_markup=reply_markup, parse_mode="Markdown")
     
     # Set user state to expect deposit amount
     context.user_data['expecting_crypto_deposit'] = True
@@ -478,7 +511,7 @@ async def process_deposit_amount(update: Update, context: ContextTypes.DEFAULT_T
     user_id = update.effective_user.id
     
     # Create invoice
-    invoice = create_deposit_invoice(user_id, amount, asset)
+    invoice = await create_deposit_invoice(user_id, amount, asset)
     
     if not invoice:
         await update.message.reply_text("Sorry, there was an error creating your deposit invoice. Please try again later.")
@@ -487,8 +520,8 @@ async def process_deposit_amount(update: Update, context: ContextTypes.DEFAULT_T
     # Create payment button
     keyboard = [
         [InlineKeyboardButton("💳 Pay Now", url=invoice["pay_url"])],
-        [InlineKeyboardButton("Check Payment Status", callback_data=f"check_deposit_{invoice['invoice_id']}")],
-        [InlineKeyboardButton("🔙 Back to Main", callback_data="back_to_main")]
+        [InlineKeyboardButton("Check Payment Status", callback_data=callback_data(Action.CHECK_DEPOSIT, invoice['invoice_id']))],
+        [InlineKeyboardButton("🔙 Back to Main", callback_data=callback_data(Action.MAIN_MENU))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -504,27 +537,34 @@ async def check_deposit_status(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
     
-    invoice_id = query.data.split('_')[2]
+    invoice_id = context.args[0]
     
-    # Get invoice details from database
-    conn = sqlite3.connect("referral_bot.db", check_same_thread=False, timeout=10)
+    message, reply_markup = await check_invoice(invoice_id)
+    await edit_message(query, message, reply_markup=reply_markup)
 
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM payment_invoices WHERE invoice_id = ?", (invoice_id,))
-    invoice_record = cursor.fetchone()
+async def check_invoice(invoice_id):
+    """Check an invoice with Crypto Pay, crediting it if it was paid.
+
+    Returns the (message, reply_markup) to show the user.
+    """
+    # Get invoice details from database
+    invoice_record = fetchone("SELECT * FROM payment_invoices WHERE invoice_id = ?", (invoice_id,))
     
     if not invoice_record:
-        await query.edit_message_text("Invoice not found. Please contact support.")
-        conn.close()
-        return
+        return "Invoice not found. Please contact support.", None
+    
+    # Already confirmed (usually by the Crypto Pay webhook) - no API call needed
+    if invoice_record[4] == "paid":
+        return (
+            "✅ This invoice has already been paid and processed.",
+            InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back to Main", callback_data=callback_data(Action.MAIN_MENU))]])
+        )
     
     # Check status with API
-    invoice = get_invoice_status(invoice_id)
+    invoice = await get_invoice_status(invoice_id)
     
     if not invoice:
-        await query.edit_message_text("Unable to check invoice status. Please try again later.")
-        conn.close()
-        return
+        return "Unable to check invoice status. Please try again later.", None
     
     # Extract info
     db_status = invoice_record[4]
@@ -535,17 +575,12 @@ async def check_deposit_status(update: Update, context: ContextTypes.DEFAULT_TYP
     
     # If status changed to paid
     if db_status != "paid" and api_status == "paid":
-        # Update database
-        cursor.execute(
-            "UPDATE payment_invoices SET status = ?, paid_at = ? WHERE invoice_id = ?",
-            ("paid", datetime.now().strftime("%Y-%m-%d %H:%M:%S"), invoice_id)
-        )
-        conn.commit()
-        
-        # Process the deposit
-        result = process_successful_deposit(user_id, amount, asset)
+        # Mark paid and credit the deposit
+        result = await process_successful_deposit(user_id, amount, asset, invoice_id=invoice_id)
         
-        if result["success"]:
+        if result.get("already_processed"):
+            message = f"✅ This invoice has already been paid and processed."
+        elif result["success"]:
             message = (
                 f"✅ Deposit confirmed: {amount} {asset} (${result['usd_amount']:.2f})\n\n"
                 f"Your deposit has been added to your account.\n\n"
@@ -568,18 +603,14 @@ async def check_deposit_status(update: Update, context: ContextTypes.DEFAULT_TYP
     else:
         message = f"❌ This invoice is {api_status}. Please create a new deposit request."
     
-    conn.close()
-    
     # Create response buttons
     keyboard = []
     if api_status == "active":
         keyboard.append([InlineKeyboardButton("💳 Pay Now", url=invoice["pay_url"])])
-        keyboard.append([InlineKeyboardButton("Check Again", callback_data=f"check_deposit_{invoice_id}")])
-    
-    keyboard.append([InlineKeyboardButton("🔙 Back to Main", callback_data="back_to_main")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+        keyboard.append([InlineKeyboardButton("Check Again", callback_data=callback_data(Action.CHECK_DEPOSIT, invoice_id))])
     
-    await query.edit_message_text(message, reply_markup=reply_markup)
+    keyboard.append([InlineKeyboardButton("🔙 Back to Main", callback_data=callback_data(Action.MAIN_MENU))])
+    return message, InlineKeyboardMarkup(keyboard)
 
 async def withdraw_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle withdrawal request."""
@@ -589,31 +620,28 @@ async def withdraw_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
     
     # Get user balance
-    conn = sqlite3.connect('referral_bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT deposit_amount, earning_amount, user_id FROM users WHERE user_id = ?", (user_id,))
-    user_data = cursor.fetchone()
-    
+    user_info = get_user_info(user_id)
+
     
-    if not user_data:
-        await query.edit_message_text(
+    if not user_info:
+        await edit_message(query,
             "💸 *Withdraw Funds*\n\n"
             "You don't have an account with us yet. Please start using the bot first.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="back_to_main")]]),
+            reply_markup=BACK_TO_MAIN_MARKUP,
             parse_mode="Markdown"
         )
         return
         
-    deposit = user_data[0] if user_data[0] else 0
-    earning = user_data[1] if user_data[1] else 0
+    deposit = user_info['deposit_amount'] or 0
+    earning = user_info['earning_amount'] or 0
     available_balance = deposit + earning
     
     if available_balance <= 0:
-        await query.edit_message_text(
+        await edit_message(query,
             "💸 *Withdraw Funds*\n\n"
             "You currently have no funds available to withdraw.\n\n"
             "Earn by referring friends and claiming daily bonuses!",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="back_to_main")]]),
+            reply_markup=BACK_TO_MAIN_MARKUP,
             parse_mode="Markdown"
         )
         return   
@@ -625,31 +653,23 @@ async def withdraw_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['deposit_amount'] = deposit
     
     # 🔍 Check referral count
-    cursor.execute("""
-        SELECT COUNT(*) FROM users WHERE referrer_id = ?
-    """, (user_id,))
-    referral_count = cursor.fetchone()[0]
+    referral_count = user_info['referral_count'] or 0
 
     if referral_count < 3:
-        await query.edit_message_text(
+        await edit_message(query,
             f"❌ *Withdrawal Locked*\n\n"
             f"To withdraw funds, you must refer at least *3 new users* using your referral link.\n\n"
             f"You have referred only *{referral_count}* user(s) so far.\n"
             f"Start sharing your referral link to unlock withdrawals!",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="back_to_main")]]),
+            reply_markup=BACK_TO_MAIN_MARKUP,
             parse_mode="Markdown"
         )
         return
-    conn.close()
-    # Show asset selection
-    keyboard = []
-    for asset, details in SUPPORTED_ASSETS.items():
-        keyboard.append([InlineKeyboardButton(f"{details['name']} ({asset})", callback_data=f"withdraw_asset_{asset}")])
     
-    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="back_to_main")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Show asset selection
+    reply_markup = WITHDRAW_ASSETS_MARKUP
     
-    await query.edit_message_text(
+    await edit_message(query,
         f"💸 *Withdraw Funds*\n\n"
         f"Available Balance: ${available_balance:.2f}\n"
         f"- From earnings: ${earning:.2f}\n"
@@ -664,10 +684,9 @@ async def withdraw_asset_selected(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     await query.answer()
     
-    # Extract selected asset from callback data
-    asset = query.data.split('_')[2]
+    # Selected asset from callback data
+    asset = context.args[0]
     available_balance = context.user_data.get('available_balance', 0)
-    earning_amount = context.user_data.get('earning_amount', 0)
     
     # Store selected asset in user data
     context.user_data['selected_asset'] = asset
@@ -675,59 +694,25 @@ async def withdraw_asset_selected(update: Update, context: ContextTypes.DEFAULT_
     min_amount = SUPPORTED_ASSETS[asset]['min_withdrawal']
 
     # Calculate approximate crypto amount based on USD
-    approx_crypto = convert_from_usd(available_balance, asset)
-    
-    # Store state for expecting wallet address
-    context.user_data['expecting_wallet_address'] = True
-    
-    message = (
-        f"💸 *Withdraw {asset}*\n\n"
-        f"Available Balance: ${available_balance:.2f} \n"
-        f"Withdrawal Amount: ${earning_amount:.2f} \n"
-        f"Minimum withdrawal: {min_amount} {asset}\n\n"
-        f"Please enter your {asset} wallet address:"
-    )
+    approx_crypto = await convert_from_usd(available_balance, asset)
+    min_usd = await convert_to_usd(min_amount, asset)
     
-    keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="withdraw")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(message, reply_markup=reply_markup, parse_mode="Markdown")
-
-async def process_wallet_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Process the wallet address entered by the user."""
-    # Reset state
-    context.user_data['expecting_wallet_address'] = False
-    
-    wallet_address = update.message.text.strip()
-    
-    # Simple validation - in reality, you'd want more robust validation based on the specific cryptocurrency
-    if len(wallet_address) < 10:
-        await update.message.reply_text("Please enter a valid wallet address (at least 10 characters).")
-        context.user_data['expecting_wallet_address'] = True
-        return
-    
-    # Store wallet address
-    context.user_data['wallet_address'] = wallet_address
-    asset = context.user_data.get('selected_asset', DEFAULT_ASSET)
-    available_balance = context.user_data.get('available_balance', 0)
-    min_amount = SUPPORTED_ASSETS[asset]['min_withdrawal']
+    # Set up state for expecting withdrawal amount
+    context.user_data.pop('expecting_wallet_address', None)
+    context.user_data['expecting_crypto_withdrawal'] = True
     
-    # Calculate approximate crypto amount based on USD
-    approx_crypto = convert_from_usd(available_balance, asset)
-    min_usd = convert_to_usd(min_amount, asset)
-
     message = (
         f"💸 *Withdraw {asset}*\n\n"
         f"Available Balance: ${available_balance:.2f} (≈ {approx_crypto:.8f} {asset})\n"
         f"Minimum withdrawal: {min_amount} {asset} (≈ ${min_usd:.2f})\n\n"
-        f"Wallet address: `{wallet_address}`\n\n"
-        f"Now, please enter the amount of {asset} you wish to withdraw:"
+        f"Withdrawals are paid to your @CryptoBot wallet, the one linked to this Telegram account.\n\n"
+        f"Please enter the amount of {asset} you wish to withdraw:"
     )
     
-    # Set up state for expecting withdrawal amount
-    context.user_data['expecting_crypto_withdrawal'] = True
+    keyboard = [[InlineKeyboardButton("🔙 Back", callback_data=callback_data(Action.WITHDRAW))]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.message.reply_text(message, parse_mode="Markdown")
+    await edit_message(query, message, reply_markup=reply_markup, parse_mode="Markdown")
 
 async def process_withdrawal_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Process the crypto withdrawal amount entered by user."""
@@ -737,7 +722,6 @@ async def process_withdrawal_amount(update: Update, context: ContextTypes.DEFAUL
     try:
         amount = float(update.message.text.strip())
         asset = context.user_data.get('selected_asset', DEFAULT_ASSET)
-        wallet_address = context.user_data.get('wallet_address', '')
         available_balance = context.user_data.get('available_balance', 0)
         min_amount = SUPPORTED_ASSETS[asset]['min_withdrawal']
         
@@ -747,12 +731,12 @@ async def process_withdrawal_amount(update: Update, context: ContextTypes.DEFAUL
             return
             
         # Convert to USD for balance check
-        usd_amount = convert_to_usd(amount, asset)
+        usd_amount = await convert_to_usd(amount, asset)
         
         if usd_amount > available_balance:
             await update.message.reply_text(
                 f"Insufficient funds. Your maximum withdrawal amount is ${available_balance:.2f} "
-                f"(≈ {convert_from_usd(available_balance, asset):.8f} {asset}).\n\n"
+                f"(≈ {await convert_from_usd(available_balance, asset):.8f} {asset}).\n\n"
                 f"Please enter a smaller amount."
             )
             context.user_data['expecting_crypto_withdrawal'] = True
@@ -765,7 +749,7 @@ async def process_withdrawal_amount(update: Update, context: ContextTypes.DEFAUL
     user_id = update.effective_user.id
     
     # Create withdrawal request
-    result = create_withdrawal_request(user_id, amount, asset, wallet_address, usd_amount)
+    result = create_withdrawal_request(user_id, amount, asset, PAYOUT_DESTINATION, usd_amount)
     
     if not result["success"]:
         await update.message.reply_text(
@@ -776,7 +760,6 @@ async def process_withdrawal_amount(update: Update, context: ContextTypes.DEFAUL
     
     # Notify admins about the withdrawal request
     try:
-        from admin import ADMIN_IDS
         await notify_admins_of_withdrawal(
             update,
             context, 
@@ -785,7 +768,7 @@ async def process_withdrawal_amount(update: Update, context: ContextTypes.DEFAUL
             result["request_id"], 
             amount, 
             asset, 
-            wallet_address
+            PAYOUT_DESTINATION
         )
     except Exception as e:
         logger.error(f"Failed to notify admins: {e}")
@@ -793,7 +776,7 @@ async def process_withdrawal_amount(update: Update, context: ContextTypes.DEFAUL
     message = (
         f"✅ Withdrawal request submitted!\n\n"
         f"Amount: {amount} {asset} (≈ ${usd_amount:.2f})\n"
-        f"To: `{wallet_address}`\n\n"
+        f"To: your @CryptoBot wallet\n\n"
         f"Your request has been sent to our administrators for processing. "
         f"Usually it Takes 72 hours to process.\n\n"
         f"You will be notified once it's approved.\n\n"
@@ -801,8 +784,8 @@ async def process_withdrawal_amount(update: Update, context: ContextTypes.DEFAUL
     )
     
     keyboard = [
-        [InlineKeyboardButton("📊 My Account", callback_data="account")],
-        [InlineKeyboardButton("🔙 Back", callback_data="back_to_main")]
+        [InlineKeyboardButton("📊 My Account", callback_data=callback_data(Action.ACCOUNT))],
+        [InlineKeyboardButton("🔙 Back", callback_data=callback_data(Action.MAIN_MENU))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -817,10 +800,6 @@ async def handle_payment_message(update: Update, context: ContextTypes.DEFAULT_T
         await process_deposit_amount(update, context)
         return True
     
-    if context.user_data.get('expecting_wallet_address', False):
-        await process_wallet_address(update, context)
-        return True
-    
     if context.user_data.get('expecting_crypto_withdrawal', False):
         await process_withdrawal_amount(update, context)
         return True
@@ -831,23 +810,22 @@ async def handle_payment_message(update: Update, context: ContextTypes.DEFAULT_T
 # Setup function to add handlers to the application
 def add_payment_handlers(application):
     """Add payment system handlers to the main application."""
-    # Override deposit and withdraw handlers
-    application.add_handler(CallbackQueryHandler(deposit_handler, pattern="^deposit$"))
-    application.add_handler(CallbackQueryHandler(withdraw_handler, pattern="^withdraw$"))
+    # Deposit and withdraw menus
+    router.add(Action.DEPOSIT, deposit_handler)
+    router.add(Action.WITHDRAW, withdraw_handler)
     
-    # Add asset selection handlers
-    application.add_handler(CallbackQueryHandler(deposit_asset_selected, pattern="^deposit_asset_"))
-    application.add_handler(CallbackQueryHandler(withdraw_asset_selected, pattern="^withdraw_asset_"))
+    # Asset selection
+    router.add(Action.DEPOSIT_ASSET, deposit_asset_selected)
+    router.add(Action.WITHDRAW_ASSET, withdraw_asset_selected)
     
-    # Add invoice status check handler
-    application.add_handler(CallbackQueryHandler(check_deposit_status, pattern="^check_deposit_"))
+    # Invoice status check
+    router.add(Action.CHECK_DEPOSIT, check_deposit_status, cost=2)
     
-    # Set up database tables
-    setup_payment_database()
+    # Keep exchange rates for all supported assets warm
+    application.job_queue.run_repeating(rate_service.refresh_job, interval=CACHE_TTL, first=0, name="refresh_exchange_rates")
     
-    # Test API connection
-    if not test_api_connection():
-        logger.error("Failed to connect to Crypto Pay API. Payment system may not function correctly.")
+    # Settle invoices nobody checked (or whose webhook was missed)
+    application.job_queue.run_repeating(reconcile_invoices_job, interval=RECONCILE_INTERVAL, first=RECONCILE_INTERVAL, name="reconcile_invoices")
     
     logger.info("Payment system initialized")
 
@@ -856,6 +834,5 @@ def should_handle_payment_message(context):
     """Check if the current message should be handled by the payment system."""
     return (
         context.user_data.get('expecting_crypto_deposit', False) or
-        context.user_data.get('expecting_wallet_address', False) or
         context.user_data.get('expecting_crypto_withdrawal', False)
     )
\ No newline at end of file
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import os
+from decimal import Decimal
+from database import transaction, execute, fetchall
+from crypto_pay import CryptoPayError
+from payment_method import crypto_pay
+from fanout import notifier
+from callbacks import Action, callback_data
+from config import ADMIN_IDS
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+
+logger = logging.getLogger(__name__)
+
+# Approved withdrawals are paid by Crypto Pay's transfer method to the
+# requesting user's @CryptoBot wallet. Each request's spend_id is derived
+# from its request_id, so retrying a transfer can never pay twice.
+#
+# Status flow: approved -> processing -> completed
+#                           |-> approved again (transient error, retried later)
+#                           |-> failed (permanent error or out of attempts)
+#
+# Claiming a request counts an attempt and leases it for PAYOUT_LEASE
+# seconds (in next_payout_at). A request left in processing by a crash is
+# only picked up again once its lease expires, and fails after
+# MAX_PAYOUT_ATTEMPTS like any other error.
+#
+# A failed request may still have been paid: a timed-out or lost transfer
+# response, or a run that crashed mid-transfer, says nothing about what
+# Crypto Pay did. settle_failed_payouts() looks such requests up by
+# spend_id and must run before any refund.
+PAYOUT_INTERVAL = 30                                              # seconds between queue scans
+PAYOUT_BATCH_SIZE = 100
+PAYOUT_CONCURRENCY = int(os.getenv("PAYOUT_CONCURRENCY", 3))      # transfers in flight per asset
+MAX_PAYOUT_ATTEMPTS = 5
+RETRY_BACKOFF = 60                                                # seconds, doubled per attempt
+PAYOUT_LEASE = 600                                                # seconds before a stuck claim is retried
+
+# API errors worth retrying; any other error name fails the payout
+RETRYABLE_ERRORS = {"INSUFFICIENT_FUNDS"}
+
+_asset_limits = {}
+_running = asyncio.Lock()
+_rescan = False   # set when new approvals arrive during a run
+
+
+def spend_id_for(request_id):
+    return f"withdrawal-{request_id}"
+
+
+def _format_amount(amount):
+    return format(Decimal(str(amount)).normalize(), "f")
+
+
+def _asset_limit(asset):
+    if asset not in _asset_limits:
+        _asset_limits[asset] = asyncio.Semaphore(PAYOUT_CONCURRENCY)
+    return _asset_limits[asset]
+
+
+def claim_due_payouts(limit=PAYOUT_BATCH_SIZE, exclude=()):
+    """Move up to ``limit`` due requests to processing and return them.
+
+    Due means approved and past its retry time, or left in processing by a
+    crashed run and past its lease; their spend_id makes the repeated
+    transfer safe. ``exclude`` skips request_ids already tried this run.
+    Returns (claimed rows, abandoned rows): abandoned requests were stuck
+    in processing with no attempts left and are now failed.
+    """
+    with transaction(immediate=True) as conn:
+        abandoned = conn.execute(
+            "SELECT request_id, payout_attempts, payout_error FROM withdrawal_requests "
+            "WHERE status = 'processing' AND next_payout_at <= datetime('now') AND payout_attempts >= ?",
+            (MAX_PAYOUT_ATTEMPTS,)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE withdrawal_requests SET status = 'failed', processed_at = datetime('now') WHERE request_id = ?",
+            [(row[0],) for row in abandoned]
+        )
+        rows = conn.execute(
+            "SELECT request_id, user_id, amount, asset, payout_attempts + 1 FROM withdrawal_requests "
+            "WHERE (status IN ('approved', 'processing') "
+            "AND (next_payout_at IS NULL OR next_payout_at <= datetime('now'))) "
+            "AND request_id NOT IN (SELECT value FROM json_each(?)) "
+            "ORDER BY request_id LIMIT ?",
+            (json.dumps(list(exclude)), limit)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE withdrawal_requests SET status = 'processing', spend_id = ?, payout_attempts = ?, "
+            "next_payout_at = datetime('now', ?) WHERE request_id = ?",
+            [(spend_id_for(row[0]), row[4], f"+{PAYOUT_LEASE} seconds", row[0]) for row in rows]
+        )
+    return rows, abandoned
+
+
+async def _find_transfer(spend_id):
+    result = await crypto_pay.get_transfers(spend_id=spend_id)
+    items = (result or {}).get("items")
+    return items[0] if items else None
+
+
+async def pay_withdrawal(bot, row):
+    """Transfer one claimed request and record the outcome.
+
+    ``row`` is (request_id, user_id, amount, asset, attempts), where
+    attempts already counts this one.
+    """
+    request_id, user_id, amount, asset, attempts = row
+    spend_id = spend_id_for(request_id)
+
+    async with _asset_limit(asset):
+        try:
+            transfer = await crypto_pay.transfer(
+                user_id=user_id,
+                asset=asset,
+                amount=_format_amount(amount),
+                spend_id=spend_id,
+                comment=f"Withdrawal #{request_id}"
+            )
+        except CryptoPayError as e:
+            transfer = None
+            if e.name and "SPEND_ID" in e.name:
+                # An earlier attempt went through but its response was lost
+                try:
+                    transfer = await _find_transfer(spend_id)
+                except CryptoPayError as lookup_error:
+                    e = lookup_error
+            if transfer is None:
+                return record_payout_failure(bot, request_id, attempts, e)
+
+    record_payout_success(bot, request_id, user_id, amount, asset, transfer)
+    return True
+
+
+def record_payout_success(bot, request_id, user_id, amount, asset, transfer):
+    execute(
+        "UPDATE withdrawal_requests SET status = 'completed', transfer_id = ?, payout_error = NULL, "
+        "next_payout_at = NULL, processed_at = datetime('now') WHERE request_id = ?",
+        (transfer["transfer_id"], request_id)
+    )
+    logger.info(f"Paid withdrawal #{request_id}: transfer {transfer['transfer_id']}")
+    notifier.enqueue(bot, user_id, f"💸 Your withdrawal of {amount} {asset} has been sent to your @CryptoBot wallet.")
+
+
+def record_payout_failure(bot, request_id, attempts, error):
+    retryable = error.name is None or error.name in RETRYABLE_ERRORS
+    if retryable and attempts < MAX_PAYOUT_ATTEMPTS:
+        delay = RETRY_BACKOFF * 2 ** (attempts - 1)
+        execute(
+            "UPDATE withdrawal_requests SET status = 'approved', payout_attempts = ?, payout_error = ?, "
+            "next_payout_at = datetime('now', ?) WHERE request_id = ?",
+            (attempts, str(error), f"+{delay} seconds", request_id)
+        )
+        logger.warning(f"Payout of withdrawal #{request_id} failed (attempt {attempts}), retrying in {delay}s: {error}")
+        return False
+
+    execute(
+        "UPDATE withdrawal_requests SET status = 'failed', payout_attempts = ?, payout_error = ?, "
+        "processed_at = datetime('now') WHERE request_id = ?",
+        (attempts, str(error), request_id)
+    )
+    logger.error(f"Payout of withdrawal #{request_id} failed permanently: {error}")
+    notify_payout_failed(bot, request_id, attempts, error)
+    return False
+
+
+def notify_payout_failed(bot, request_id, attempts, error):
+    """Offer admins Retry / Reject & refund for a failed payout."""
+    keyboard = InlineKeyboardMarkup([[
+        InlineKeyboardButton("🔁 Retry", callback_data=callback_data(Action.APPROVE_WITHDRAWAL, request_id)),
+        InlineKeyboardButton("❌ Reject & refund", callback_data=callback_data(Action.REJECT_WITHDRAWAL, request_id))
+    ]])
+    for admin_id in ADMIN_IDS:
+        notifier.enqueue(
+            bot,
+            admin_id,
+            f"⚠️ Payout of withdrawal #{request_id} failed after {attempts} attempts: {error}",
+            reply_markup=keyboard
+        )
+
+
+async def settle_failed_payouts(bot, request_ids):
+    """Complete the failed requests among ``request_ids`` that were paid after all.
+
+    Looks each failed request that reached Crypto Pay up by its spend_id.
+    Returns the request_ids found paid, now completed. Raises
+    CryptoPayError if a lookup fails, so the caller refunds nothing blind.
+    """
+    if not request_ids:
+        return set()
+    placeholders = ",".join("?" * len(request_ids))
+    rows = fetchall(
+        "SELECT request_id, user_id, amount, asset, spend_id FROM withdrawal_requests "
+        f"WHERE status = 'failed' AND spend_id IS NOT NULL AND request_id IN ({placeholders})",
+        list(request_ids)
+    )
+    paid = set()
+    for request_id, user_id, amount, asset, spend_id in rows:
+        transfer = await _find_transfer(spend_id)
+        if transfer is not None:
+            logger.warning(f"Failed withdrawal #{request_id} was paid after all")
+            record_payout_success(bot, request_id, user_id, amount, asset, transfer)
+            paid.add(request_id)
+    return paid
+
+
+async def run_payouts(bot):
+    """Pay every due approved withdrawal, batch by batch, until the queue is empty."""
+    global _rescan
+    if _running.locked():
+        _rescan = True
+        return
+    async with _running:
+        paid = failed = 0
+        attempted = set()
+        while True:
+            _rescan = False
+            rows, abandoned = claim_due_payouts(exclude=attempted)
+            for request_id, attempts, error in abandoned:
+                logger.error(f"Withdrawal #{request_id} stuck in processing after {attempts} attempts, marked failed")
+                notify_payout_failed(bot, request_id, attempts, error or "payout did not complete")
+            attempted.update(row[0] for row in rows)
+            if rows:
+                results = await asyncio.gather(*(pay_withdrawal(bot, row) for row in rows), return_exceptions=True)
+                for row, result in zip(rows, results):
+                    if isinstance(result, Exception):
+                        # Left in processing; retried with the same spend_id once its lease expires
+                        logger.error(f"Payout of withdrawal #{row[0]} crashed: {result}")
+                paid += sum(result is True for result in results)
+                failed += sum(result is not True for result in results)
+            if len(rows) < PAYOUT_BATCH_SIZE and not _rescan:
+                break
+        if paid or failed:
+            logger.info(f"Payout run finished: {paid} paid, {failed} failed or deferred")
+
+
+def schedule_payouts(application):
+    """Start a payout run now instead of waiting for the next scan."""
+    application.create_task(run_payouts(application.bot))
+
+
+async def payout_job(context):
+    await run_payouts(context.bot)
+
+
+def add_payout_worker(application):
+    application.job_queue.run_repeating(payout_job, interval=PAYOUT_INTERVAL, first=PAYOUT_INTERVAL, name="pay_withdrawals")
+    logger.info("Payout worker scheduled")
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+from database import transaction, fetchone
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """Keeps context.user_data in the user_state table so flows survive restarts.
+
+    Only user_data is stored. Nothing is read at startup: a user's state is
+    loaded the first time one of their updates is handled. On each
+    persistence run only users whose data actually changed are written,
+    all of them in one transaction. Values must be JSON-serializable.
+    """
+
+    def __init__(self, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._loaded = set()     # users whose stored state is already in memory
+        self._written = {}       # { user_id: last JSON written or loaded }
+        self._pending = {}       # { user_id: JSON to write, or None to delete }
+        self._write_scheduled = False
+
+    # user_data
+
+    async def get_user_data(self):
+        # Loaded per user in refresh_user_data instead
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        row = fetchone("SELECT data FROM user_state WHERE user_id = ?", (user_id,))
+        if row:
+            self._written[user_id] = row[0]
+            user_data.update(json.loads(row[0]))
+
+    async def update_user_data(self, user_id, data):
+        try:
+            blob = json.dumps(data, sort_keys=True, separators=(",", ":")) if data else None
+        except TypeError as e:
+            logger.error(f"Cannot persist user_data for {user_id}: {e}")
+            return
+        if self._written.get(user_id) == blob:
+            return
+        self._queue(user_id, blob)
+
+    async def drop_user_data(self, user_id):
+        self._loaded.discard(user_id)
+        self._queue(user_id, None)
+
+    def _queue(self, user_id, blob):
+        self._pending[user_id] = blob
+        if not self._write_scheduled:
+            # The Application gathers every update_user_data call of a
+            # persistence run; writing once they have all queued their
+            # change batches the whole run into one transaction.
+            self._write_scheduled = True
+            asyncio.get_running_loop().call_soon(self._write_pending)
+
+    def _write_pending(self):
+        self._write_scheduled = False
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        upserts = [(user_id, blob) for user_id, blob in pending.items() if blob is not None]
+        deletes = [(user_id,) for user_id, blob in pending.items() if blob is None]
+        try:
+            with transaction(immediate=True) as conn:
+                conn.executemany(
+                    "INSERT INTO user_state (user_id, data, updated_at) VALUES (?, ?, datetime('now')) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    upserts
+                )
+                conn.executemany("DELETE FROM user_state WHERE user_id = ?", deletes)
+        except Exception as e:
+            logger.error(f"Failed to persist user_data for {len(pending)} users: {e}")
+            # Retry on the next run unless newer data was queued meanwhile
+            for user_id, blob in pending.items():
+                self._pending.setdefault(user_id, blob)
+            return
+
+        for user_id, blob in pending.items():
+            if blob is None:
+                self._written.pop(user_id, None)
+            else:
+                self._written[user_id] = blob
+        logger.debug(f"Persisted user_data: {len(upserts)} written, {len(deletes)} deleted")
+
+    async def flush(self):
+        self._write_pending()
+
+    # Not stored
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
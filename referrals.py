@@ -0,0 +1,134 @@
+import logging
+from datetime import datetime
+from database import transaction
+from user_cache import invalidate_user, invalidate_all
+import ledger
+from config import TIERS
+
+logger = logging.getLogger(__name__)
+
+# users.referral_count and users.depositing_referral_count are maintained
+# in the same transactions that register referred users and credit their
+# first deposit, so reading them is a primary-key lookup.
+BACKFILL_BATCH_SIZE = 5000   # users recounted per write transaction
+
+
+def record_new_referral(conn, referrer_id):
+    """Count a newly registered referral (inside the /start transaction)."""
+    conn.execute(
+        "UPDATE users SET referral_count = referral_count + 1 WHERE user_id = ?",
+        (referrer_id,)
+    )
+    invalidate_user(referrer_id)
+
+
+def record_first_deposit(conn, user_id):
+    """Count ``user_id`` as a depositing referral if this is their first deposit.
+
+    Must run inside the deposit transaction, before the deposit's own
+    transaction row is inserted.
+    """
+    first_deposit = not conn.execute(
+        "SELECT 1 FROM transactions WHERE user_id = ? AND type LIKE 'deposit_%' LIMIT 1",
+        (user_id,)
+    ).fetchone()
+    if first_deposit:
+        referrer = conn.execute("SELECT referrer_id FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if referrer and referrer[0]:
+            conn.execute(
+                "UPDATE users SET depositing_referral_count = depositing_referral_count + 1 WHERE user_id = ?",
+                (referrer[0],)
+            )
+            invalidate_user(referrer[0])
+
+
+def pay_referral_bonuses(conn, deposits):
+    """Credit referrers their tier's referral_bonus on a batch of deposits.
+
+    ``deposits`` is a list of (user_id, usd_amount). Runs inside the
+    caller's deposit transaction: one query looks up every depositor's
+    referrer and tier, and all ledger credits and ``referral_bonus``
+    transaction rows are written with executemany. Returns [(referrer_id, bonus, user_id)].
+    """
+    if not deposits:
+        return []
+    
+    user_ids = list({user_id for user_id, _ in deposits})
+    placeholders = ",".join("?" * len(user_ids))
+    referrers = {
+        user_id: (referrer_id, tier)
+        for user_id, referrer_id, tier in conn.execute(
+            "SELECT u.user_id, r.user_id, r.tier FROM users u "
+            f"JOIN users r ON r.user_id = u.referrer_id WHERE u.user_id IN ({placeholders})",
+            user_ids
+        )
+    }
+    
+    payouts = []
+    for user_id, usd_amount in deposits:
+        if user_id not in referrers:
+            continue
+        referrer_id, tier = referrers[user_id]
+        rate = TIERS.get(tier, TIERS['Bronze'])['referral_bonus']
+        bonus = usd_amount * rate / 100
+        if bonus > 0:
+            payouts.append((referrer_id, bonus, user_id))
+    
+    if payouts:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        ledger.post_many(conn, [
+            (referrer_id, ledger.EARNING, bonus, "referral_bonus") for referrer_id, bonus, _ in payouts
+        ])
+        conn.executemany(
+            "INSERT INTO transactions (user_id, amount, type, timestamp) VALUES (?, ?, 'referral_bonus', ?)",
+            [(referrer_id, bonus, timestamp) for referrer_id, bonus, _ in payouts]
+        )
+        invalidate_user(*{referrer_id for referrer_id, _, _ in payouts})
+    return payouts
+
+
+REFERRAL_COUNTS_SQL = '''
+UPDATE users SET
+    referral_count = (
+        SELECT COUNT(*) FROM users r WHERE r.referrer_id = users.user_id
+    ),
+    depositing_referral_count = (
+        SELECT COUNT(*) FROM users r
+        WHERE r.referrer_id = users.user_id
+          AND EXISTS (
+              SELECT 1 FROM transactions t
+              WHERE t.user_id = r.user_id AND t.type LIKE 'deposit_%'
+          )
+    )
+'''
+
+
+def backfill_referral_counts(conn=None, batch_size=BACKFILL_BATCH_SIZE):
+    """Recompute both referral counters for every user from the raw tables.
+
+    Pass ``conn`` to update every user inside the caller's transaction.
+    Otherwise works through users in user_id ranges of ``batch_size``, one
+    short write transaction each, like users.retier_users; the counters
+    stay exact because each range is recomputed under the write lock.
+    """
+    if conn is not None:
+        conn.execute(REFERRAL_COUNTS_SQL)
+        updated = conn.execute("SELECT changes()").fetchone()[0]
+    else:
+        updated = 0
+        last_id = -2 ** 63
+        while True:
+            with transaction(immediate=True) as conn:
+                bounds = conn.execute(
+                    "SELECT MIN(user_id), MAX(user_id) FROM ("
+                    "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?)",
+                    (last_id, batch_size)
+                ).fetchone()
+                if bounds[0] is None:
+                    break
+                conn.execute(REFERRAL_COUNTS_SQL + "WHERE user_id BETWEEN ? AND ?", bounds)
+                updated += conn.execute("SELECT changes()").fetchone()[0]
+            last_id = bounds[1]
+    invalidate_all()
+    logger.info(f"Backfilled referral counters for {updated} users")
+    return updated
@@ -0,0 +1,84 @@
+import logging
+from hashlib import blake2b
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
+from user_cache import LRUCache
+from callbacks import Action, callback_data
+
+logger = logging.getLogger(__name__)
+
+# Keyboards and texts that never change are built once at import. PTB
+# markups are immutable, so the same object can be sent to every user.
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💰 Make Deposit", callback_data=callback_data(Action.DEPOSIT)),
+    InlineKeyboardButton("🎁 Daily Bonus", callback_data=callback_data(Action.DAILY_BONUS))],
+    [InlineKeyboardButton("💸 Withdraw", callback_data=callback_data(Action.WITHDRAW)),
+    InlineKeyboardButton("👥 My Referrals", callback_data=callback_data(Action.REFERRALS))],
+    [InlineKeyboardButton("📊 My Account", callback_data=callback_data(Action.ACCOUNT)),
+    InlineKeyboardButton("📜 History", callback_data=callback_data(Action.HISTORY))]
+])
+
+ACCOUNT_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💰 Make Deposit", callback_data=callback_data(Action.DEPOSIT)),
+    InlineKeyboardButton("🎁 Daily Bonus", callback_data=callback_data(Action.DAILY_BONUS))],
+    [InlineKeyboardButton("💸 Withdraw", callback_data=callback_data(Action.WITHDRAW)),
+    InlineKeyboardButton("👥 My Referrals", callback_data=callback_data(Action.REFERRALS))],
+    [InlineKeyboardButton("📜 History", callback_data=callback_data(Action.HISTORY)),
+    InlineKeyboardButton("🔙 Back", callback_data=callback_data(Action.MAIN_MENU))]
+])
+
+BACK_TO_MAIN_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=callback_data(Action.MAIN_MENU))]])
+
+# Hash of the last content rendered into each (chat_id, message_id)
+_last_rendered = LRUCache(maxsize=50000, ttl=3600)
+
+
+class Verbatim(str):
+    """A string render_markdown must not escape, e.g. one inside a `code` span."""
+
+
+def render_markdown(template, **fields):
+    """Fill a Markdown template, escaping every string field.
+
+    Numbers are passed through untouched so format specs like ``{x:.2f}``
+    keep working, and so are Verbatim strings.
+    """
+    return template.format(**{
+        key: escape_markdown(value) if isinstance(value, str) and not isinstance(value, Verbatim) else value
+        for key, value in fields.items()
+    })
+
+
+def _content_hash(text, reply_markup, parse_mode):
+    digest = blake2b(digest_size=16)
+    digest.update(text.encode())
+    digest.update(str(parse_mode).encode())
+    if reply_markup is not None:
+        digest.update(str(hash(reply_markup)).encode())
+    return digest.digest()
+
+
+async def edit_message(query, text, reply_markup=None, parse_mode=None, **kwargs):
+    """edit_message_text that skips edits which would not change the message.
+
+    Repeated presses of the same button would otherwise cost a Bot API call
+    that fails with "Message is not modified".
+    """
+    message = query.message
+    key = (message.chat_id, message.message_id) if message else None
+    content = _content_hash(text, reply_markup, parse_mode)
+
+    if key is not None and _last_rendered.get(key) == content:
+        return None
+
+    try:
+        result = await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode, **kwargs)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+        result = None
+
+    if key is not None:
+        _last_rendered.set(key, content)
+    return result
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+from time import perf_counter
+from callbacks import Action, decode
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Updates run concurrently, up to MAX_CONCURRENT_UPDATES at a time, but
+# never two for the same user: a user's updates run one after another in
+# arrival order, so their user_data and balance reads cannot interleave.
+# Admin approve/reject presses are also serialized per withdrawal request.
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", 32))
+# Updates accepted at once, running or waiting for their user; only bounds
+# memory if Telegram floods us
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", 10000))
+
+# Single-request admin actions, keyed by their request_id argument
+REQUEST_ACTIONS = {Action.APPROVE_WITHDRAWAL, Action.REJECT_WITHDRAWAL}
+
+
+def serialization_keys(update):
+    """Keys whose updates must not run at the same time, in lock order."""
+    keys = []
+    user = update.effective_user
+    if user is not None:
+        keys.append(f"user:{user.id}")
+    query = update.callback_query
+    if query is not None:
+        action, args = decode(query.data)
+        if action in REQUEST_ACTIONS and args:
+            keys.append(f"withdrawal:{args[0]}")
+    # Always acquired in sorted order, so two updates sharing keys can't deadlock
+    return sorted(keys)
+
+
+class _KeyLock:
+    __slots__ = ("lock", "holders")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.holders = 0   # updates running or waiting on this key
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates concurrently while serializing those that share a key.
+
+    BaseUpdateProcessor.process_update is final and takes its semaphore
+    first, so the base class gets the generous ``max_pending_updates`` and
+    ``max_running`` is enforced here: an update first waits for its keys,
+    then for a running slot. Updates queued behind a busy user hold no
+    slot, so a flooding user cannot starve the others.
+
+    ``admit(update)``, if given, is awaited before any key is taken; when it
+    returns False the update is dropped without running its handlers.
+    """
+
+    def __init__(self, max_running=MAX_CONCURRENT_UPDATES, max_pending_updates=MAX_PENDING_UPDATES, admit=None):
+        super().__init__(max_pending_updates)
+        self.admit = admit
+        self.max_running = max_running
+        self._slots = asyncio.Semaphore(max_running)
+        self._keys = {}
+        self.running = 0
+        self.waiting = 0          # updates waiting for a key or a running slot
+        self.peak_waiting = 0
+        self.processed = 0
+        self.max_wait = 0.0
+
+    async def do_process_update(self, update, coroutine):
+        if not isinstance(update, Update):
+            update = None
+        if update is not None and self.admit is not None:
+            try:
+                admitted = await self.admit(update)
+            except BaseException:
+                coroutine.close()
+                raise
+            if not admitted:
+                coroutine.close()
+                return
+        keys = serialization_keys(update) if update is not None else []
+        key_locks = [self._hold(key) for key in keys]
+        queued = perf_counter()
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        started = False
+        acquired = []
+        try:
+            for key_lock in key_locks:
+                await key_lock.lock.acquire()
+                acquired.append(key_lock)
+            async with self._slots:
+                started = True
+                self.waiting -= 1
+                self.max_wait = max(self.max_wait, perf_counter() - queued)
+                self.running += 1
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+        finally:
+            if not started:
+                self.waiting -= 1
+                # Never awaited: close it so Python doesn't warn
+                coroutine.close()
+            for key_lock in acquired:
+                key_lock.lock.release()
+            for key in keys:
+                self._release(key)
+            self.processed += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _hold(self, key):
+        key_lock = self._keys.get(key)
+        if key_lock is None:
+            key_lock = self._keys[key] = _KeyLock()
+        key_lock.holders += 1
+        return key_lock
+
+    def _release(self, key):
+        key_lock = self._keys[key]
+        key_lock.holders -= 1
+        if key_lock.holders == 0:
+            del self._keys[key]
+
+    def queue_depths(self):
+        """Updates queued behind each busy key, deepest first."""
+        return sorted(
+            ((key, key_lock.holders - 1) for key, key_lock in self._keys.items() if key_lock.holders > 1),
+            key=lambda item: -item[1]
+        )
+
+    def report(self):
+        deepest = ", ".join(f"{key} {depth}" for key, depth in self.queue_depths()[:5]) or "none"
+        return (
+            f"Running {self.running}/{self.max_running}, "
+            f"waiting {self.waiting} (peak {self.peak_waiting}), {self.processed} processed, "
+            f"max wait {self.max_wait * 1000:.0f} ms\n"
+            f"Deepest queues: {deepest}"
+        )
@@ -0,0 +1,214 @@
+import logging
+from datetime import datetime, timedelta
+from database import transaction, fetchall, read_connection
+from ledger import MINOR_UNITS
+
+logger = logging.getLogger(__name__)
+
+# Rollups behind /stats. Triggers keep them current inside the same
+# transaction as the write that changes them (registration, transaction
+# row, tier change, withdrawal status change), so the dashboard never
+# scans users or transactions. rebuild_stats() recomputes them from the
+# raw tables.
+#
+# stats_daily        (day, metric): transaction type (deposit_USDT,
+#                    daily_bonus, ...) or 'signup' / 'referred_signup'
+# stats_tiers        users per tier
+# stats_withdrawals  (status, asset): request count and USD value
+STATS_DAYS = 7
+
+
+def _upsert_daily(day, metric, count, amount):
+    return (
+        f"INSERT INTO stats_daily (day, metric, count, amount_micros) VALUES ({day}, {metric}, {count}, {amount}) "
+        "ON CONFLICT(day, metric) DO UPDATE SET count = count + excluded.count, "
+        "amount_micros = amount_micros + excluded.amount_micros;"
+    )
+
+
+def _upsert_withdrawals(status, asset, count, usd):
+    return (
+        f"INSERT INTO stats_withdrawals (status, asset, count, usd_micros) VALUES ({status}, {asset}, {count}, {usd}) "
+        "ON CONFLICT(status, asset) DO UPDATE SET count = count + excluded.count, "
+        "usd_micros = usd_micros + excluded.usd_micros;"
+    )
+
+
+def _micros(column):
+    return f"CAST(ROUND(COALESCE({column}, 0) * {MINOR_UNITS}) AS INTEGER)"
+
+
+def create_stats_schema(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        amount_micros INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, metric)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_tiers (
+        tier TEXT PRIMARY KEY,
+        users INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_withdrawals (
+        status TEXT NOT NULL,
+        asset TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        usd_micros INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (status, asset)
+    ) WITHOUT ROWID
+    ''')
+
+    today = "date('now', 'localtime')"
+    withdrawal_usd = _micros("COALESCE(NEW.usd_amount, NEW.amount)")
+    old_withdrawal_usd = _micros("COALESCE(OLD.usd_amount, OLD.amount)")
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS stats_on_signup AFTER INSERT ON users BEGIN
+        {_upsert_daily(f"COALESCE(substr(NEW.join_date, 1, 10), {today})", "'signup'", 1, 0)}
+        {_upsert_daily(f"COALESCE(substr(NEW.join_date, 1, 10), {today})", "'referred_signup'", "NEW.referrer_id IS NOT NULL", 0)}
+        INSERT INTO stats_tiers (tier, users) VALUES (NEW.tier, 1)
+        ON CONFLICT(tier) DO UPDATE SET users = users + 1;
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_on_tier_change AFTER UPDATE OF tier ON users
+    WHEN OLD.tier IS NOT NEW.tier BEGIN
+        UPDATE stats_tiers SET users = users - 1 WHERE tier = OLD.tier;
+        INSERT INTO stats_tiers (tier, users) VALUES (NEW.tier, 1)
+        ON CONFLICT(tier) DO UPDATE SET users = users + 1;
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS stats_on_transaction AFTER INSERT ON transactions BEGIN
+        {_upsert_daily(f"COALESCE(substr(NEW.timestamp, 1, 10), {today})", "NEW.type", 1, _micros("NEW.amount"))}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS stats_on_withdrawal AFTER INSERT ON withdrawal_requests BEGIN
+        {_upsert_withdrawals("NEW.status", "NEW.asset", 1, withdrawal_usd)}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS stats_on_withdrawal_status AFTER UPDATE OF status ON withdrawal_requests
+    WHEN OLD.status IS NOT NEW.status BEGIN
+        UPDATE stats_withdrawals SET count = count - 1, usd_micros = usd_micros - {old_withdrawal_usd}
+        WHERE status = OLD.status AND asset = OLD.asset;
+        {_upsert_withdrawals("NEW.status", "NEW.asset", 1, withdrawal_usd)}
+    END
+    ''')
+
+
+# True rollup contents, computed from the raw tables
+DAILY_SQL = '''
+SELECT substr(join_date, 1, 10), 'signup', COUNT(*), 0 FROM users
+WHERE join_date IS NOT NULL GROUP BY 1
+UNION ALL
+SELECT substr(join_date, 1, 10), 'referred_signup', COUNT(referrer_id), 0 FROM users
+WHERE join_date IS NOT NULL GROUP BY 1
+UNION ALL
+SELECT substr(timestamp, 1, 10), type, COUNT(*), SUM(''' + _micros("amount") + ''') FROM transactions
+WHERE timestamp IS NOT NULL AND type IS NOT NULL GROUP BY 1, 2
+'''
+TIERS_SQL = "SELECT tier, COUNT(*) FROM users GROUP BY tier"
+WITHDRAWALS_SQL = '''
+SELECT status, asset, COUNT(*), SUM(''' + _micros("COALESCE(usd_amount, amount)") + ''')
+FROM withdrawal_requests WHERE status IS NOT NULL AND asset IS NOT NULL GROUP BY status, asset
+'''
+
+# table, key columns, value columns, source query
+ROLLUPS = (
+    ("stats_daily", ("day", "metric"), ("count", "amount_micros"), DAILY_SQL),
+    ("stats_tiers", ("tier",), ("users",), TIERS_SQL),
+    ("stats_withdrawals", ("status", "asset"), ("count", "usd_micros"), WITHDRAWALS_SQL),
+)
+
+
+def _totals(rows, key_count):
+    """{key tuple: [values]} from (keys..., values...) rows, summing duplicates."""
+    totals = {}
+    for row in rows:
+        key, values = row[:key_count], row[key_count:]
+        current = totals.setdefault(key, [0] * len(values))
+        for i, value in enumerate(values):
+            current[i] += value or 0
+    return totals
+
+
+def rebuild_stats(conn=None):
+    """Recompute every rollup from users, transactions and withdrawal_requests.
+
+    Pass ``conn`` to rebuild inside the caller's transaction. Otherwise the
+    scans run on a read-only snapshot, without the write lock, together with
+    a read of the rollups as of that snapshot; the difference is then added
+    to the rollups in one short write. Trigger updates made while the scans
+    ran are kept, so nothing blocks deposits or claims for long.
+    """
+    if conn is not None:
+        for table, keys, values, source in ROLLUPS:
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f"INSERT INTO {table} ({', '.join(keys + values)}) {source}")
+        logger.info("Rebuilt statistics rollups")
+        return
+
+    corrections = {}
+    with read_connection() as reader:
+        reader.execute("BEGIN")   # one snapshot for the scans and the rollups
+        try:
+            for table, keys, values, source in ROLLUPS:
+                actual = _totals(reader.execute(source), len(keys))
+                stored = _totals(reader.execute(f"SELECT {', '.join(keys + values)} FROM {table}"), len(keys))
+                deltas = []
+                for key in actual.keys() | stored.keys():
+                    delta = [a - s for a, s in zip(actual.get(key, [0] * len(values)), stored.get(key, [0] * len(values)))]
+                    if any(delta):
+                        deltas.append((*key, *delta))
+                corrections[table] = deltas
+        finally:
+            reader.rollback()
+
+    with transaction(immediate=True) as conn:
+        for table, keys, values, _ in ROLLUPS:
+            columns = keys + values
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                f"ON CONFLICT({', '.join(keys)}) DO UPDATE SET "
+                + ", ".join(f"{value} = {value} + excluded.{value}" for value in values),
+                corrections[table]
+            )
+            conn.execute(f"DELETE FROM {table} WHERE " + " AND ".join(f"{value} = 0" for value in values))
+    logger.info(f"Rebuilt statistics rollups ({sum(map(len, corrections.values()))} corrections)")
+
+
+def get_stats(days=STATS_DAYS):
+    """Dashboard numbers from the rollups only.
+
+    Returns a dict with 'today' and 'period' ({metric: (count, usd)} for
+    today and the last ``days`` days), 'tiers' ({tier: users}) and
+    'withdrawals' ({status: (count, usd)}).
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+    period, today_stats = {}, {}
+    for day, metric, count, amount in fetchall(
+        "SELECT day, metric, count, amount_micros FROM stats_daily WHERE day >= ?", (since,)
+    ):
+        for totals in (period, today_stats) if day == today else (period,):
+            previous_count, previous_amount = totals.get(metric, (0, 0))
+            totals[metric] = (previous_count + count, previous_amount + amount / MINOR_UNITS)
+
+    withdrawals = {}
+    for status, count, usd in fetchall("SELECT status, SUM(count), SUM(usd_micros) FROM stats_withdrawals GROUP BY status"):
+        withdrawals[status] = (count, usd / MINOR_UNITS)
+
+    return {
+        "today": today_stats,
+        "period": period,
+        "tiers": dict(fetchall("SELECT tier, users FROM stats_tiers")),
+        "withdrawals": withdrawals,
+    }
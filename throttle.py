@@ -0,0 +1,45 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Button presses per user: a bucket of THROTTLE_BURST presses refilled at
+# THROTTLE_RATE per second. Expensive routes cost more than one token
+# (see CallbackRouter.add).
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", 1.0))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", 5))
+THROTTLE_MESSAGE = "⏳ Too many taps, please wait a moment."
+MAX_TRACKED_USERS = 100000
+
+
+class UserThrottle:
+    """Per-user token buckets that answer immediately instead of waiting.
+
+    Unlike fanout.TokenBucket, which paces our own sends, a press over the
+    limit is simply refused. Users idle long enough to be evicted from the
+    LRU come back with a full bucket, which is what they would have anyway.
+    """
+
+    def __init__(self, rate=THROTTLE_RATE, burst=THROTTLE_BURST, exempt=(), maxsize=MAX_TRACKED_USERS):
+        self.rate = rate
+        self.burst = burst
+        self.exempt = set(exempt)
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()   # user_id -> (tokens, updated)
+
+    def allow(self, user_id, cost=1):
+        if user_id in self.exempt:
+            return True
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[user_id] = (tokens, now)
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return allowed
+
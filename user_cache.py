@@ -0,0 +1,74 @@
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+# In-memory caches of per-user rows that menus re-read on every click.
+# Every code path that changes a user's balance, tier, referral counters or
+# claim state must call invalidate_user() for that user.
+CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+CACHE_TTL = 300  # seconds; bounds staleness if a write path is ever missed
+
+
+class LRUCache:
+    """Bounded LRU cache whose entries also expire after ``ttl`` seconds.
+
+    Locked, because bulk jobs (/retier, /recount_referrals) run in worker
+    threads and invalidate from there.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # { key: (value, expires_at) }
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] < monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+profile_cache = LRUCache(CACHE_SIZE, CACHE_TTL)   # get_user_info results
+claim_cache = LRUCache(CACHE_SIZE, CACHE_TTL)     # get_user_claim_status results
+
+
+def invalidate_user(*user_ids):
+    """Drop cached rows for users whose data just changed."""
+    for user_id in user_ids:
+        if user_id is not None:
+            profile_cache.pop(user_id)
+            claim_cache.pop(user_id)
+
+
+def invalidate_all():
+    """Drop every cached row (after bulk updates)."""
+    profile_cache.clear()
+    claim_cache.clear()
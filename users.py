@@ -0,0 +1,154 @@
+import logging
+from datetime import datetime
+from database import transaction, fetchone
+from ledger import to_minor, from_minor
+from user_cache import profile_cache, invalidate_user, invalidate_all
+from config import TIER_THRESHOLDS
+
+logger = logging.getLogger(__name__)
+
+# Database setup
+def setup_database():
+    with transaction() as conn:
+        # Create users table
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            referrer_id INTEGER,
+            deposit_micros INTEGER NOT NULL DEFAULT 0,
+            earning_micros INTEGER NOT NULL DEFAULT 0,
+            tier TEXT DEFAULT 'Bronze',
+            join_date TEXT,
+            FOREIGN KEY (referrer_id) REFERENCES users(user_id)
+        )
+        ''')
+        
+        # Create transactions table
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            type TEXT,
+            timestamp TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        ''')
+
+# Users re-tiered per write transaction by retier_users
+RETIER_BATCH_SIZE = 50000
+
+# Helper functions
+def get_user_tier(deposit_amount):
+    """Determine user tier based on deposit amount."""
+    for min_deposit, name in TIER_THRESHOLDS:
+        if deposit_amount >= min_deposit:
+            return name
+    return TIER_THRESHOLDS[-1][1]
+
+def tier_case_sql():
+    """SQL expression computing get_user_tier from users.deposit_micros."""
+    branches = " ".join(
+        f"WHEN deposit_micros >= {to_minor(min_deposit)} THEN '{name}'"
+        for min_deposit, name in TIER_THRESHOLDS[:-1]
+    )
+    return f"CASE {branches} ELSE '{TIER_THRESHOLDS[-1][1]}' END"
+
+def retier_users(batch_size=RETIER_BATCH_SIZE):
+    """Recompute every user's tier from TIERS with set-based UPDATEs.
+
+    Works through users in user_id ranges of ``batch_size``, one short write
+    transaction each, so deposits are not blocked for the whole run.
+    Returns {(old_tier, new_tier): users moved}.
+    """
+    new_tier = tier_case_sql()
+    moved = {}
+    last_id = None
+    while True:
+        with transaction(immediate=True) as conn:
+            bounds = conn.execute(
+                "SELECT MIN(user_id), MAX(user_id) FROM ("
+                "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?)",
+                (last_id if last_id is not None else -2 ** 63, batch_size)
+            ).fetchone()
+            if bounds[0] is None:
+                break
+            changes = conn.execute(
+                f"SELECT tier, {new_tier} AS new_tier, COUNT(*) FROM users "
+                f"WHERE user_id BETWEEN ? AND ? AND tier IS NOT {new_tier} GROUP BY tier, new_tier",
+                bounds
+            ).fetchall()
+            if changes:
+                conn.execute(
+                    f"UPDATE users SET tier = {new_tier} WHERE user_id BETWEEN ? AND ? AND tier IS NOT {new_tier}",
+                    bounds
+                )
+        for old, new, count in changes:
+            moved[(old, new)] = moved.get((old, new), 0) + count
+        last_id = bounds[1]
+
+    if moved:
+        invalidate_all()
+    logger.info(f"Re-tiered {sum(moved.values())} users: {moved}")
+    return moved
+
+def update_user_tier(user_id, deposit_amount, conn=None):
+    """Set the user's tier for their (already posted) deposit balance.
+
+    Pass ``conn`` to run inside the caller's transaction.
+    """
+    if conn is None:
+        with transaction() as conn:
+            return update_user_tier(user_id, deposit_amount, conn)
+    
+    new_tier = get_user_tier(deposit_amount)
+    
+    conn.execute("UPDATE users SET tier = ? WHERE user_id = ?", (new_tier, user_id))
+    invalidate_user(user_id)
+    
+    return new_tier
+
+def add_transaction(user_id, amount, transaction_type, conn=None):
+    """Record a transaction.
+
+    Pass ``conn`` to run inside the caller's transaction.
+    """
+    if conn is None:
+        with transaction() as conn:
+            return add_transaction(user_id, amount, transaction_type, conn)
+    
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    conn.execute(
+        "INSERT INTO transactions (user_id, amount, type, timestamp) VALUES (?, ?, ?, ?)",
+        (user_id, amount, transaction_type, timestamp)
+    )
+
+def get_user_info(user_id):
+    """Get user information, served from the profile cache when possible."""
+    cached = profile_cache.get(user_id)
+    if cached is not None:
+        return cached
+    
+    user = fetchone(
+        "SELECT user_id, username, referrer_id, deposit_micros, earning_micros, tier, join_date, "
+        "referral_count, depositing_referral_count FROM users WHERE user_id = ?",
+        (user_id,)
+    )
+    
+    if user:
+        user_info = {
+            'user_id': user[0],
+            'username': user[1],
+            'referrer_id': user[2],
+            'deposit_amount': from_minor(user[3]),
+            'earning_amount': from_minor(user[4]),
+            'tier': user[5],
+            'join_date': user[6],
+            'referral_count': user[7],
+            'depositing_referral_count': user[8]
+        }
+        profile_cache.set(user_id, user_info)
+        return user_info
+    return None
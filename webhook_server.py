@@ -0,0 +1,83 @@
+import json
+import logging
+import tornado.web
+from telegram import Update
+from payment_method import verify_webhook_signature, handle_invoice_paid
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    """Receives Telegram updates and hands them to the PTB application."""
+
+    def initialize(self, bot_app, secret_token=None):
+        self.bot_app = bot_app
+        self.secret_token = secret_token
+
+    async def post(self):
+        if self.secret_token and self.request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret_token:
+            self.set_status(403)
+            return
+
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_app.bot)
+        except Exception as e:
+            logger.error(f"Invalid Telegram update: {e}")
+            self.set_status(400)
+            return
+
+        await self.bot_app.update_queue.put(update)
+        self.set_status(200)
+
+
+class CryptoPayWebhookHandler(tornado.web.RequestHandler):
+    """Receives Crypto Pay webhooks and credits paid invoices."""
+
+    def initialize(self, bot_app):
+        self.bot_app = bot_app
+
+    async def post(self):
+        if not self.bot_app.running:
+            # Still starting up; Crypto Pay redelivers on non-200
+            self.set_status(503)
+            return
+
+        signature = self.request.headers.get("crypto-pay-api-signature")
+        if not verify_webhook_signature(self.request.body, signature):
+            logger.warning("Rejected Crypto Pay webhook with bad signature")
+            self.set_status(401)
+            return
+
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+
+        if data.get("update_type") == "invoice_paid":
+            try:
+                await handle_invoice_paid(self.bot_app.bot, data["payload"])
+            except Exception as e:
+                # Non-200 makes Crypto Pay redeliver; crediting is idempotent
+                logger.error(f"Error handling invoice_paid webhook: {e}")
+                self.set_status(500)
+                return
+
+        self.set_status(200)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write("ok")
+
+
+def start_webhook_server(application, port, webhook_path, cryptopay_path, secret_token=None):
+    """Serve Telegram and Crypto Pay webhooks from one HTTP server."""
+    app = tornado.web.Application([
+        (webhook_path, TelegramWebhookHandler, {"bot_app": application, "secret_token": secret_token}),
+        (cryptopay_path, CryptoPayWebhookHandler, {"bot_app": application}),
+        (r"/", HealthHandler),
+    ])
+    server = app.listen(port, address="0.0.0.0", xheaders=True)
+    logger.info(f"Webhook server listening on port {port}")
+    return server
@@ -0,0 +1,116 @@
+import logging
+from datetime import datetime
+from database import transaction, fetchall, fetchone
+from user_cache import invalidate_user
+import ledger
+
+logger = logging.getLogger(__name__)
+
+WITHDRAWALS_PAGE_SIZE = 8
+
+PENDING_COLUMNS = "request_id, user_id, amount, asset, wallet_address, usd_amount"
+
+# Requests an admin can still approve or reject by id: new ones, and ones
+# whose payout failed (see payouts.py)
+ACTIONABLE = "status IN ('pending', 'failed')"
+
+
+def get_pending_withdrawals(after=None, before=None, limit=WITHDRAWALS_PAGE_SIZE):
+    """One page of pending withdrawal requests, oldest first.
+
+    Keyset pagination on (status, request_id), like get_referrals.
+    Returns (rows, has_prev, has_next).
+    """
+    if before is not None:
+        rows = fetchall(
+            f"SELECT {PENDING_COLUMNS} FROM withdrawal_requests "
+            "WHERE status = 'pending' AND request_id < ? ORDER BY request_id DESC LIMIT ?",
+            (before, limit + 1)
+        )
+        has_prev = len(rows) > limit
+        return rows[:limit][::-1], has_prev, True
+
+    rows = fetchall(
+        f"SELECT {PENDING_COLUMNS} FROM withdrawal_requests "
+        "WHERE status = 'pending' AND request_id > ? ORDER BY request_id LIMIT ?",
+        (after if after is not None else -1, limit + 1)
+    )
+    return rows[:limit], after is not None, len(rows) > limit
+
+
+def count_pending_withdrawals(max_usd=None):
+    """(count, total USD) of pending requests, optionally only those up to ``max_usd``."""
+    if max_usd is None:
+        row = fetchone("SELECT COUNT(*), COALESCE(SUM(usd_amount), 0) FROM withdrawal_requests WHERE status = 'pending'")
+    else:
+        row = fetchone(
+            "SELECT COUNT(*), COALESCE(SUM(usd_amount), 0) FROM withdrawal_requests "
+            "WHERE status = 'pending' AND usd_amount <= ?",
+            (max_usd,)
+        )
+    return row
+
+
+def _select_actionable(conn, request_ids=None, max_usd=None):
+    if request_ids is not None:
+        if not request_ids:
+            return []
+        placeholders = ",".join("?" * len(request_ids))
+        return conn.execute(
+            f"SELECT {PENDING_COLUMNS} FROM withdrawal_requests "
+            f"WHERE {ACTIONABLE} AND request_id IN ({placeholders})",
+            list(request_ids)
+        ).fetchall()
+    return conn.execute(
+        f"SELECT {PENDING_COLUMNS} FROM withdrawal_requests "
+        "WHERE status = 'pending' AND usd_amount <= ?",
+        (max_usd,)
+    ).fetchall()
+
+
+def approve_withdrawals(request_ids=None, max_usd=None):
+    """Approve the given requests, or every pending one worth at most ``max_usd``.
+
+    Approved requests are queued for the payout worker. All status changes
+    happen in one transaction; requests that can no longer be approved are
+    skipped. Returns the approved rows
+    (request_id, user_id, amount, asset, wallet_address, usd_amount).
+    """
+    with transaction(immediate=True) as conn:
+        rows = _select_actionable(conn, request_ids, max_usd)
+        conn.executemany(
+            "UPDATE withdrawal_requests SET status = 'approved', payout_attempts = 0, "
+            "next_payout_at = NULL, payout_error = NULL WHERE request_id = ?",
+            [(row[0],) for row in rows]
+        )
+    logger.info(f"Approved {len(rows)} withdrawal requests")
+    return rows
+
+
+def reject_withdrawals(request_ids):
+    """Reject requests and refund their balances in one transaction.
+
+    Refunds the USD amount that was deducted when the request was created
+    (the asset amount for requests made before usd_amount was recorded).
+    Failed requests may have been paid regardless: run
+    payouts.settle_failed_payouts on them first. Returns the rejected rows.
+    """
+    with transaction(immediate=True) as conn:
+        rows = _select_actionable(conn, request_ids)
+        ledger.post_many(conn, [
+            (user_id, ledger.EARNING, usd_amount if usd_amount is not None else amount, "withdrawal_refund")
+            for _, user_id, amount, _, _, usd_amount in rows
+        ])
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn.executemany(
+            "INSERT INTO transactions (user_id, amount, type, timestamp) VALUES (?, ?, 'withdrawal_refund', ?)",
+            [(user_id, usd_amount if usd_amount is not None else amount, timestamp)
+             for _, user_id, amount, _, _, usd_amount in rows]
+        )
+        conn.executemany(
+            "UPDATE withdrawal_requests SET status = 'rejected', processed_at = datetime('now') WHERE request_id = ?",
+            [(row[0],) for row in rows]
+        )
+    invalidate_user(*{row[1] for row in rows})
+    logger.info(f"Rejected {len(rows)} withdrawal requests")
+    return rows